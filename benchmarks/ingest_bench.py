@@ -0,0 +1,196 @@
+"""
+Пропускная способность приема обновлений для каждой конфигурации event loop и JSON-кодека.
+Запуск: python -m benchmarks.ingest_bench [количество_обновлений] [postgres://... для polling]
+webhook: обновления отправляются POST-запросами на локальный сервер с TenantWebhookHandler,
+как их присылает Telegram, и проходят разбор, LoadShedder и Dispatcher (без обработчиков).
+polling: Poller получает те же обновления через getUpdates от локального заменителя Bot API.
+Если указана база, пачки сохраняются в polling_inbox, как в работе; без нее - в памяти,
+и измеряется только прием.
+Каждая конфигурация запускается в отдельном процессе: политику event loop и кодек
+нужно выбрать до создания loop. Неустановленные uvloop и кодеки пропускаются.
+"""
+import asyncio
+import importlib
+import json
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+import asyncpg
+from aiohttp import web
+from aiogram.bot import api
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.utils import context
+
+from benchmarks.json_bench import CODECS, sample_updates
+from bot.db import ensure_schema
+from bot.polling import Poller
+from bot.shedding import LoadShedder
+from bot.speedups import install_event_loop, install_json
+from bot.tenants import RateLimiter, TenantWebhookHandler, create_tenants
+
+TOKEN = '123456:BenchmarkTokenBenchmarkTokenBenchmark'
+# Одновременных запросов, как у Telegram с max_connections по умолчанию
+CONCURRENCY = 40
+
+
+def free_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    return sock
+
+
+async def send(url: str, bodies: list, concurrency: int = CONCURRENCY):
+    """
+    Отправить тела обновлений из concurrency соединений одновременно.
+    """
+    queue = iter(bodies)
+    async with aiohttp.ClientSession() as session:
+        async def worker():
+            for body in queue:
+                async with session.post(url, data=body, headers={'Content-Type': 'application/json'}) as response:
+                    await response.read()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def webhook(tenant, bodies: list) -> float:
+    """
+    Обновлений в секунду через TenantWebhookHandler.
+    """
+    app = web.Application()
+    app.router.add_route('*', tenant.path, TenantWebhookHandler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    sock = free_socket()
+    await web.SockSite(runner, sock).start()
+    try:
+        start = time.perf_counter()
+        await send(f'http://127.0.0.1:{sock.getsockname()[1]}{tenant.path}', bodies)
+        return len(bodies) / (time.perf_counter() - start)
+    finally:
+        await runner.cleanup()
+
+
+class MemoryPoller(Poller):
+    """
+    Poller, хранящий смещение и необработанные обновления в памяти.
+    """
+
+    async def _load(self) -> list:
+        return []
+
+    async def _store(self, updates: list, offset: int) -> bool:
+        return True
+
+    async def _done(self, update_id: int):
+        pass
+
+
+async def fake_bot_api(bodies: list) -> web.AppRunner:
+    """
+    Заменитель Bot API: getUpdates отдает заранее подготовленные обновления с учетом offset и limit.
+    """
+    updates = [json.loads(body) for body in bodies]
+
+    async def handler(request: web.Request) -> web.Response:
+        if request.match_info['method'].lower() != 'getupdates':
+            return web.json_response({'ok': True, 'result': True})
+        params = await request.post()
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        result = [update for update in updates if update['update_id'] >= offset][:limit]
+        if not result:
+            # Новых обновлений нет: long polling ждет
+            await asyncio.sleep(float(params.get('timeout', 0)))
+        return web.json_response({'ok': True, 'result': result})
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    sock = free_socket()
+    await web.SockSite(runner, sock).start()
+    api.API_URL = f'http://127.0.0.1:{sock.getsockname()[1]}/bot{{token}}/{{method}}'
+    return runner
+
+
+async def polling(tenant, bodies: list, dsn: str = None) -> float:
+    """
+    Обновлений в секунду через Poller.
+    """
+    runner = await fake_bot_api(bodies)
+    pool = None
+    if dsn:
+        pool = await asyncpg.create_pool(dsn)
+        async with pool.acquire() as con:
+            await ensure_schema(con)
+            await con.execute('DELETE FROM polling_offsets WHERE bot_name=$1', tenant.name)
+            await con.execute('DELETE FROM polling_inbox WHERE bot_name=$1', tenant.name)
+    poller = (Poller if dsn else MemoryPoller)(tenant, pool, timeout=1)
+    try:
+        start = time.perf_counter()
+        poller.start(asyncio.get_event_loop())
+        while tenant.metrics['updates'] < len(bodies):
+            await asyncio.sleep(0.001)
+        await poller.stop()
+        return len(bodies) / (time.perf_counter() - start)
+    finally:
+        if pool is not None:
+            await pool.close()
+        await runner.cleanup()
+
+
+def run(mode: str, loop_name: str, codec: str, count: int, dsn: str = None):
+    """
+    Одна конфигурация в текущем процессе.
+    """
+    install_event_loop(loop_name == 'uvloop')
+    install_json(codec)
+    loop = asyncio.get_event_loop()
+    loop.set_task_factory(context.task_factory)
+    tenant, = create_tenants([{'name': 'bench', 'token': TOKEN, 'bot_id': 1, 'owner': 1,
+                               'channel': None, 'path': '/webhook'}],
+                             loop, MemoryStorage, RateLimiter(30), LoadShedder())
+    bodies = sample_updates(count)
+    if mode == 'webhook':
+        rate = loop.run_until_complete(webhook(tenant, bodies))
+    else:
+        rate = loop.run_until_complete(polling(tenant, bodies, dsn))
+    loop.run_until_complete(tenant.bot.close())
+    print(f'{rate:.0f}')
+
+
+def installed(name: str) -> bool:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        return False
+    return True
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        run(*sys.argv[2:4], sys.argv[4], int(sys.argv[5]), *sys.argv[6:])
+        return
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    dsn = sys.argv[2:3]
+    print(f'Обновлений: {count}, одновременных запросов webhook: {CONCURRENCY}, '
+          f"polling: {'polling_inbox в ' + dsn[0] if dsn else 'без БД'}")
+    for loop_name in ('asyncio', 'uvloop'):
+        if loop_name == 'uvloop' and not installed('uvloop'):
+            print('uvloop: не установлен')
+            continue
+        for codec in CODECS:
+            if not installed(codec):
+                continue
+            for mode in ('webhook', 'polling'):
+                result = subprocess.run([sys.executable, '-m', 'benchmarks.ingest_bench', '--run',
+                                         mode, loop_name, codec, str(count), *dsn], stdout=subprocess.PIPE)
+                rate = result.stdout.decode().strip().splitlines()[-1] if result.returncode == 0 else 'ошибка'
+                print(f'{mode}, {loop_name} + {codec}: {rate} обновлений/с')
+
+
+if __name__ == '__main__':
+    main()
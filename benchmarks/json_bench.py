@@ -0,0 +1,73 @@
+"""
+Скорость разбора входящих обновлений разными JSON-кодеками (см. bot.speedups).
+Запуск: python -m benchmarks.json_bench [количество_обновлений]
+Меряется то же, что делает TenantWebhookHandler.parse_update: тело запроса -> types.Update.
+Сеть не нужна; кодеки, которые не установлены, пропускаются.
+"""
+import json
+import sys
+import time
+
+from aiogram import types
+
+from bot.speedups import _codec
+
+CODECS = ('json', 'ujson', 'orjson')
+
+
+def sample_updates(count: int) -> list:
+    """
+    Тела запросов webhook'а: обычные сообщения, вступления в чат и нажатия кнопок.
+    """
+    chat = {'id': -1001234567890, 'type': 'supergroup', 'title': 'Тестовый чат'}
+    bodies = []
+    for update_id in range(count):
+        user = {'id': 100000 + update_id % 500, 'is_bot': False, 'first_name': 'Пользователь',
+                'last_name': str(update_id % 500), 'username': f'user{update_id % 500}', 'language_code': 'ru'}
+        message = {'message_id': update_id, 'date': 1540000000 + update_id, 'chat': chat, 'from': user}
+        kind = update_id % 10
+        if kind == 0:
+            update = {'update_id': update_id, 'message': {**message, 'new_chat_members': [user],
+                                                          'new_chat_member': user, 'new_chat_participant': user}}
+        elif kind == 1:
+            update = {'update_id': update_id, 'callback_query': {'id': str(update_id), 'from': user,
+                                                                 'message': message, 'chat_instance': '1',
+                                                                 'data': '+val1'}}
+        else:
+            text = 'Привет всем, как дела? Сегодня обсуждаем новости канала и правила чата. ' * (1 + kind % 3)
+            update = {'update_id': update_id, 'message': {**message, 'text': text}}
+        bodies.append(json.dumps(update, ensure_ascii=False))
+    return bodies
+
+
+def measure(func, bodies: list, repeat: int = 3) -> float:
+    """
+    Лучшая из repeat скорость, обновлений в секунду.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            func(body)
+        best = min(best, time.perf_counter() - start)
+    return len(bodies) / best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bodies = sample_updates(count)
+    size = sum(map(len, bodies)) / len(bodies)
+    print(f'Обновлений: {count}, средний размер: {size:.0f} символов')
+    for name in CODECS:
+        try:
+            loads, _ = _codec(name)
+        except ImportError:
+            print(f'{name}: не установлен')
+            continue
+        decode = measure(loads, bodies)
+        parse = measure(lambda body: types.Update(**loads(body)), bodies)
+        print(f'{name}: loads {decode:,.0f}/с, loads + types.Update {parse:,.0f}/с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Скорость проверки сообщений на запрещенные слова.
+Запуск: python -m benchmarks.normalize_bench [файл_с_сообщениями] [файл_mat_list]
+Файл сообщений - одно сообщение на строку. Без аргументов используется
+сгенерированный корпус из обычных слов, leetspeak и слов с разделителями.
+"""
+import random
+import re
+import sys
+import time
+
+from bot.normalize import find_forbidden, forbidden_words, message_words
+
+WORDS = ('привет как дела сегодня завтра чат бот админ сообщение правила вопрос ответ '
+         'спасибо пожалуйста хорошо плохо ссылка канал группа новости работа время').split()
+FORBIDDEN = 'слово,плохое,запрет,ругань,дурак'
+
+
+def disguise(word: str, rng: random.Random) -> str:
+    """
+    Способы обхода фильтра: пробелы и точки между буквами, латиница, повторы букв.
+    """
+    kind = rng.randrange(4)
+    if kind == 0:
+        return ' '.join(word)
+    if kind == 1:
+        return '.'.join(word)
+    if kind == 2:
+        return word.translate(str.maketrans('аеорсх', 'aeopcx'))
+    return ''.join(letter * rng.randint(1, 3) for letter in word)
+
+
+def generate(count: int = 10000, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    forbidden = FORBIDDEN.split(',')
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 25))]
+        if rng.random() < 0.1:
+            words.insert(rng.randrange(len(words)), disguise(rng.choice(forbidden), rng))
+        messages.append(' '.join(words))
+    return messages
+
+
+def measure(func, messages: list, repeat: int = 3) -> float:
+    """
+    Лучшее из repeat время на одно сообщение, в микросекундах.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in messages:
+            func(message)
+        best = min(best, time.perf_counter() - start)
+    return best / len(messages) * 1e6
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='utf-8') as corpus:
+            messages = [line.rstrip('\n') for line in corpus if line.strip()]
+    else:
+        messages = generate()
+    mat_list = FORBIDDEN
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], encoding='utf-8') as file:
+            mat_list = file.read().strip()
+    forbidden = forbidden_words(mat_list)
+    old_forbidden = set(mat_list.split(','))
+    word = re.compile(r'\w+')
+
+    length = sum(map(len, messages)) / len(messages)
+    print(f'Сообщений: {len(messages)}, средняя длина: {length:.0f} символов')
+    print(f"lower() + findall (без нормализации): "
+          f"{measure(lambda text: old_forbidden & set(word.findall(text.lower())), messages):.1f} мкс")
+    print(f'message_words: {measure(message_words, messages):.1f} мкс')
+    print(f'find_forbidden: {measure(lambda text: find_forbidden(text, forbidden), messages):.1f} мкс')
+    found = sum(1 for message in messages if find_forbidden(message, forbidden))
+    print(f'Найдено сообщений с запрещенными словами: {found}')
+    # Худший случай: сообщение максимальной длины из одиночных букв через пробел
+    letters = [' '.join(random.Random(2).choice('абвгдежзиклмнопрст') for _ in range(2048))]
+    print(f'find_forbidden, 4096 символов одиночных букв: '
+          f'{measure(lambda text: find_forbidden(text, forbidden), letters):.1f} мкс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Проверка чтения с реплик (ReadRouter) на основной базе и ее потоковой реплике.
+Запуск: python -m benchmarks.replica_check postgres://...основная postgres://...реплика
+Нужна тестовая база бота (таблицы settings и warn созданы) и пользователь реплики
+с правом вызывать pg_wal_replay_pause(): отставание реплики создается паузой применения WAL.
+Проверяется: чтения идут на реплику; реплика, не ответившая за timeout, пропускается;
+отстающая реплика пропускается; предупреждения (warn_do) читаются с основной базы
+и видят только что сделанную запись; после invalidate() настройки чата читаются
+с основной базы, а не прежней строкой с реплики.
+"""
+import asyncio
+import random
+import sys
+import time
+
+import asyncpg
+
+from bot.db import ReadRouter, ensure_schema, gen_prepared_query
+
+ON_REPLICA = 'SELECT pg_is_in_recovery() AS replica'
+
+
+async def routing(primary, replica) -> bool:
+    router = ReadRouter(primary, [replica])
+    on_replica = (await router._fetch(ON_REPLICA))[0]['replica']
+    router.healthy = []
+    on_primary = (await router._fetch(ON_REPLICA))[0]['replica']
+    return on_replica and not on_primary
+
+
+async def timeout(primary, replica) -> bool:
+    router = ReadRouter(primary, [replica], timeout=0.5)
+    start = time.monotonic()
+    # На реплике запрос зависает, на основной базе выполняется сразу
+    rows = await router._fetch('SELECT pg_sleep(CASE WHEN pg_is_in_recovery() THEN 5 ELSE 0 END), '
+                               'pg_is_in_recovery() AS replica')
+    return time.monotonic() - start < 2 and not rows[0]['replica'] and not router.healthy
+
+
+async def lag(primary, replica, chat_id: int) -> bool:
+    router = ReadRouter(primary, [replica], max_lag=1, interval=0.5)
+    monitor = asyncio.ensure_future(router.monitor())
+    try:
+        await asyncio.sleep(1)
+        before = (await router._fetch(ON_REPLICA))[0]['replica']
+        await primary.execute('UPDATE settings SET max_warn=max_warn WHERE chat_id=$1', chat_id)
+        await asyncio.sleep(3)
+        after = (await router._fetch(ON_REPLICA))[0]['replica']
+    finally:
+        monitor.cancel()
+    return before and not after
+
+
+async def warn_reads(primary_dsn: str, replica, chat_id: int) -> bool:
+    """
+    Запросы warn_do выполняются подготовленными выражениями основного соединения.
+    """
+    conn = await asyncpg.connect(primary_dsn)
+    try:
+        prepared_query = await gen_prepared_query(conn)
+        await prepared_query['warn_insert'].fetch(chat_id, 1)
+        await prepared_query['warn_update'].fetch(chat_id, 1)
+        count = (await prepared_query['get_warn_count'].fetch(chat_id, 1))[0]['warn_count']
+        on_replica = await replica.fetchval('SELECT warn_count FROM warn WHERE chat_id=$1 AND user_id=1', chat_id)
+        await prepared_query['warn_delete'].fetch(chat_id, 1)
+    finally:
+        await conn.close()
+    # Применение WAL на реплике приостановлено: она записи не видит, основная база - видит
+    return count == 2 and on_replica is None
+
+
+async def read_after_write(primary, replica, chat_id: int) -> bool:
+    """
+    Изменение настроек, как в обработчиках main.py: запись на основную базу и invalidate().
+    """
+    router = ReadRouter(primary, [replica])
+    before = (await router.fetch('get_warn_settings', chat_id))[0]['max_warn']
+    await primary.execute('UPDATE settings SET max_warn=$1 WHERE chat_id=$2', before + 1, chat_id)
+    router.invalidate([chat_id])
+    after = (await router.fetch('get_warn_settings', chat_id))[0]['max_warn']
+    return after == before + 1
+
+
+async def main(primary_dsn: str, replica_dsn: str):
+    conn = await asyncpg.connect(primary_dsn)
+    await ensure_schema(conn)
+    await conn.close()
+    primary = await asyncpg.create_pool(primary_dsn)
+    replica = await asyncpg.create_pool(replica_dsn)
+    chat_id = -random.randrange(10 ** 12, 10 ** 13)
+    await primary.execute('INSERT INTO settings (chat_id) VALUES ($1)', chat_id)
+    results = [('чтение с реплики', await routing(primary, replica)),
+               ('зависшая реплика', await timeout(primary, replica))]
+    await replica.execute('SELECT pg_wal_replay_pause()')
+    try:
+        results.append(('отстающая реплика', await lag(primary, replica, chat_id)))
+        results.append(('предупреждения с основной базы', await warn_reads(primary_dsn, replica, chat_id)))
+        results.append(('чтение после изменения настроек', await read_after_write(primary, replica, chat_id)))
+    finally:
+        await replica.execute('SELECT pg_wal_replay_resume()')
+        await primary.execute('DELETE FROM settings WHERE chat_id=$1', chat_id)
+        await replica.close()
+        await primary.close()
+    for name, ok in results:
+        print(f"{name}: {'OK' if ok else 'ОШИБКА'}")
+    return all(ok for _, ok in results)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.get_event_loop().run_until_complete(main(sys.argv[1], sys.argv[2])) else 1)
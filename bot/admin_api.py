@@ -0,0 +1,84 @@
+"""
+HTTP-маршруты для администратора бота.
+Доступ только с заголовком Authorization: Bearer <ADMIN_API_TOKEN>.
+"""
+import datetime
+import hmac
+
+from aiohttp import web
+
+from bot.config import ADMIN_API_TOKEN
+
+
+def _authorized(request: web.Request) -> bool:
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {ADMIN_API_TOKEN}')
+
+
+def _int_param(request: web.Request, name: str, default=None):
+    value = request.query.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f'{name} must be an integer')
+
+
+def _time_param(request: web.Request, name: str):
+    value = _int_param(request, name)
+    if value is None:
+        return None
+    return datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+
+
+async def load_handler(request: web.Request) -> web.Response:
+    """
+    GET /load - текущая нагрузка и количество отброшенной работы.
+    """
+    if not _authorized(request):
+        raise web.HTTPUnauthorized()
+    shedder = request.app['shedder']
+    shed = [{'bot': label, 'what': what, 'count': count} for (label, what), count in shedder.shed.items()]
+    bots = [dict(tenant.metrics, bot=tenant.name) for tenant in request.app['tenants']]
+    return web.json_response({'in_flight': shedder.in_flight, 'waiting': shedder.waiting,
+                              'lag': shedder.lag, 'shed': shed, 'bots': bots})
+
+
+async def memory_handler(request: web.Request) -> web.Response:
+    """
+    GET /memory?trace=start|stop|top - размер кешей, количество задач и RSS.
+    С параметром trace управляет tracemalloc и показывает топ мест выделения памяти.
+    """
+    if not _authorized(request):
+        raise web.HTTPUnauthorized()
+    return web.json_response(request.app['memory_report'](request.query.get('trace')))
+
+
+async def audit_handler(request: web.Request) -> web.Response:
+    """
+    GET /audit?chat_id=&user_id=&since=&until=&page=
+    since и until - unix-время, page - номер страницы с нуля.
+    """
+    if not _authorized(request):
+        raise web.HTTPUnauthorized()
+    rows = await request.app['audit'].query(chat_id=_int_param(request, 'chat_id'),
+                                            user_id=_int_param(request, 'user_id'),
+                                            since=_time_param(request, 'since'),
+                                            until=_time_param(request, 'until'),
+                                            page=max(_int_param(request, 'page', 0), 0),
+                                            per_page=min(max(_int_param(request, 'per_page', 50), 1), 500))
+    events = [dict(row, created_at=row['created_at'].isoformat()) for row in rows]
+    return web.json_response({'events': events})
+
+
+def setup_routes(app: web.Application, **services):
+    """
+    Зарегистрировать маршруты администратора, если задан ADMIN_API_TOKEN.
+    Сервисы (audit, shedder, tenants, memory_report) сохраняются в приложении под своими именами.
+    """
+    if not ADMIN_API_TOKEN:
+        return
+    app.update(services)
+    app.router.add_get('/audit', audit_handler)
+    app.router.add_get('/load', load_handler)
+    app.router.add_get('/memory', memory_handler)
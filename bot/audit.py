@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+import logging
+
+import asyncpg
+
+log = logging.getLogger('aiogram')
+
+COLUMNS = ('created_at', 'chat_id', 'actor_id', 'user_id', 'action', 'details')
+
+
+class AuditLog:
+    """
+    Журнал действий модерации.
+    События складываются в очередь в памяти без ожидания и записываются
+    в таблицу audit_log пачками через COPY фоновой задачей.
+    """
+
+    def __init__(self, pool: asyncpg.pool.Pool, batch_size: int = 500,
+                 interval: float = 1, queue_size: int = 10000):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._partitions = set()
+        self._stopped = asyncio.Event()
+        # Количество событий, потерянных из-за переполнения очереди или ошибок записи
+        self.dropped = 0
+
+    def log(self, action: str, chat_id: int, actor_id: int = None, user_id: int = None, details: str = None):
+        """
+        Добавить событие в очередь. Никогда не ждет и не обращается к БД.
+        """
+        record = (datetime.datetime.now(datetime.timezone.utc), chat_id, actor_id, user_id, action, details)
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    async def _ensure_partitions(self, con: asyncpg.connection.Connection, batch: list):
+        """
+        Создать помесячные партиции audit_log для событий пачки, если их еще нет.
+        """
+        for month in {record[0].date().replace(day=1) for record in batch} - self._partitions:
+            next_month = (month + datetime.timedelta(days=32)).replace(day=1)
+            await con.execute(f"CREATE TABLE IF NOT EXISTS audit_log_{month:%Y_%m} PARTITION OF audit_log "
+                              f"FOR VALUES FROM ('{month} 00:00+00') TO ('{next_month} 00:00+00')")
+            self._partitions.add(month)
+
+    async def _write(self, batch: list):
+        try:
+            async with self.pool.acquire() as con:
+                await self._ensure_partitions(con, batch)
+                await con.copy_records_to_table('audit_log', records=batch, columns=COLUMNS)
+        except (OSError, asyncpg.PostgresError):
+            self.dropped += len(batch)
+            log.exception(f'Не удалось записать {len(batch)} событий в audit_log')
+
+    def _take(self) -> list:
+        batch = []
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def flush(self):
+        """
+        Записать все накопленные события.
+        """
+        batch = self._take()
+        while batch:
+            await self._write(batch)
+            batch = self._take()
+
+    async def run(self):
+        """
+        Фоновая задача: раз в interval секунд записывает накопленные события пачками.
+        Завершается после stop(), не прерывая начатую запись.
+        """
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), self.interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    def stop(self):
+        """
+        Остановить run(). Оставшиеся события записывает flush() после завершения задачи.
+        """
+        self._stopped.set()
+
+    async def query(self, chat_id: int = None, user_id: int = None,
+                    since: datetime.datetime = None, until: datetime.datetime = None,
+                    page: int = 0, per_page: int = 20) -> list:
+        """
+        Выбрать события по чату, пользователю и промежутку времени, новые первыми.
+        """
+        conditions, args = [], []
+        for condition, value in (('chat_id = ${}', chat_id), ('user_id = ${}', user_id),
+                                 ('created_at >= ${}', since), ('created_at < ${}', until)):
+            if value is not None:
+                args.append(value)
+                conditions.append(condition.format(len(args)))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        args.extend((per_page, page * per_page))
+        return await self.pool.fetch(f"SELECT id, {', '.join(COLUMNS)} FROM audit_log {where} "
+                                     f"ORDER BY created_at DESC, id DESC LIMIT ${len(args) - 1} OFFSET ${len(args)}",
+                                     *args)
@@ -3,6 +3,10 @@ https://gist.github.com/jomido/4051adfa6f08b34f070f0854f7ae2108
 """
 
 import asyncio
+import time
+
+# Calls that have not fired yet: future -> (due time, callable, args)
+pending = {}
 
 
 def maybeAsync(callable, *args):
@@ -43,4 +47,6 @@ def call_later(delay, callable, *args, **kwargs):
     any synchronous or asynchronous callable.
     """
 
-    fire(_call_later, delay, callable, *args, **kwargs)
+    future = fire(_call_later, delay, callable, *args, **kwargs)
+    pending[future] = (time.time() + delay, callable, args)
+    future.add_done_callback(lambda f: pending.pop(f, None))
@@ -21,3 +21,73 @@ WEBHOOK_SSL_PRIV = './webhook_pkey.pem'  # Path to the ssl private key
 
 WEBAPP_HOST = ''
 WEBAPP_PORT = 443
+
+# Настройки поиска одинакового спама в разных чатах
+SPAM_INDEX_SIZE = 4096  # Сколько последних сообщений хранить в индексе
+SPAM_WINDOW = 600  # За сколько секунд учитывать повторы
+SPAM_MAX_CHATS = 3  # Сообщение удаляется, если встречалось больше чем в стольких чатах
+
+# Журнал действий модерации
+AUDIT_BATCH_SIZE = 500  # Сколько событий записывать в БД за один COPY
+AUDIT_FLUSH_INTERVAL = 1  # Как часто записывать события, в секундах
+AUDIT_QUEUE_SIZE = 10000  # Сколько событий держать в памяти до записи
+
+ADMIN_API_TOKEN = ''  # Токен для HTTP-маршрутов администратора, пустая строка - маршруты отключены
+
+STATS_FLUSH_INTERVAL = 300  # Как часто записывать статистику чатов в БД, в секундах
+STATS_RETENTION = 7 * 24  # Сколько часов хранить статистику чатов (!stats показывает не больше 168)
+
+# Боты, работающие в одном процессе. У каждого свой токен, id, владелец, канал и путь webhook'а,
+# а подключения к БД, кеши и ограничение исходящих запросов общие.
+BOTS = [
+    {'name': 'main', 'token': TOKEN, 'bot_id': BOT_ID, 'owner': MY_ID,
+     'channel': MY_CHANNEL, 'path': WEBHOOK_URL_PATH},
+]
+OUTBOUND_RATE = 30  # Общее ограничение запросов к Bot API от всех ботов, в секунду
+# Владельцы, которым доступны настройки всех чатов всех ботов (!export, !import, !template_apply all)
+GLOBAL_ADMINS = [MY_ID]
+
+# Контроль нагрузки: при превышении второстепенная работа (приветствия, сообщения об ошибках) отбрасывается
+SHED_MAX_IN_FLIGHT = 100  # Сколько обычных обновлений обрабатывать одновременно
+SHED_MAX_LAG = 0.5  # Допустимая задержка event loop, в секундах
+SHED_COMMAND_SLOTS = 10  # Сколько команд от непроверенных пользователей выполнять вне очереди
+MEMBER_STATUS_TTL = 300  # Сколько секунд помнить статус участника чата (администратор или нет)
+
+SHUTDOWN_TIMEOUT = 30  # Сколько секунд при остановке ждать завершения обработки обновлений
+
+# Ускорения (нужны установленные uvloop / orjson / ujson)
+FAST_LOOP = False  # True - использовать uvloop
+JSON_BACKEND = None  # 'orjson', 'ujson', 'json', 'auto' или None - оставить выбор aiogram
+
+# Реплики базы данных для запросов на чтение, в том же формате, что и DB
+DB_REPLICAS = []
+REPLICA_MAX_LAG = 5  # Допустимое отставание реплики, в секундах
+REPLICA_CHECK_INTERVAL = 5  # Как часто проверять отставание реплик, в секундах
+REPLICA_TIMEOUT = 1  # Сколько ждать ответа реплики, прежде чем читать с основной базы, в секундах
+SETTINGS_CACHE_TTL = 60  # Сколько секунд хранить прочитанные настройки чатов в памяти
+
+# Ограничение памяти кешей, в байтах. При превышении старые записи вытесняются
+MEMORY_BUDGET = 256 * 1024 * 1024  # Общий лимит для всех кешей
+CACHE_BUDGETS = {
+    'settings': 32 * 1024 * 1024,  # Настройки чатов
+    'forbidden_words': 64 * 1024 * 1024,  # Нормализованные списки запрещенных слов
+    'storage': 64 * 1024 * 1024,  # Состояния и счетчики throttle в MemoryStorage, для каждого бота
+    'stats': 32 * 1024 * 1024,  # Еще не записанная статистика чатов
+}
+MEMORY_CHECK_INTERVAL = 60  # Как часто проверять лимиты, в секундах
+
+# Режим ограничений при флуде: включается, когда скорость сообщений в чате выше порога
+# slow_rate_high из настроек чата, и выключается, когда она ниже slow_rate_low (сообщений в минуту)
+SLOW_MODE_WINDOW = 10  # Размер кольцевого буфера посекундных счетчиков
+SLOW_MODE_HOLD = 60  # Минимальная длительность режима ограничений, в секундах
+SLOW_MODE_MAX_CHATS = 10000  # Сколько чатов отслеживать одновременно
+SLOW_MODE_FACTOR = 5  # Во сколько раз ужесточается AntiFlood в режиме ограничений
+SLOW_MODE_NEW_MEMBER_MUTE = 10 * 60  # На сколько секунд ограничивать вступивших в режиме ограничений
+SLOW_RATE_STEP = 10  # Шаг изменения порогов кнопками настроек
+
+RESTRICTIONS_RECONCILE_INTERVAL = 60  # Как часто отмечать истекшие блокировки и запреты в БД, в секундах
+
+# Способ получения обновлений: 'webhook' или 'polling' (long polling, без HTTPS и сертификата)
+INGEST_MODE = 'webhook'
+POLLING_TIMEOUT = 20  # Время ожидания обновлений в getUpdates, в секундах
+POLLING_LIMIT = 100  # Максимум обновлений в одной пачке
@@ -1,4 +1,7 @@
+import asyncio
+import itertools
 import logging
+import time
 
 import asyncpg
 
@@ -34,21 +37,223 @@ async def create_conn(host: str, user: str, password: str,
     return conn
 
 
+# Таблицы, индексы и столбцы, добавленные после первой версии схемы.
+# Все выражения можно выполнять повторно, поэтому они применяются при каждом запуске
+# и обновляют уже существующую базу.
+SCHEMA = (
+    'ALTER TABLE settings ADD COLUMN IF NOT EXISTS slow_rate_high INTEGER DEFAULT 120',
+    'ALTER TABLE settings ADD COLUMN IF NOT EXISTS slow_rate_low INTEGER DEFAULT 40',
+    '''CREATE TABLE IF NOT EXISTS audit_log (
+            id          BIGSERIAL,
+            created_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+            chat_id     BIGINT,
+            actor_id    BIGINT,
+            user_id     BIGINT,
+            action      TEXT,
+            details     TEXT,
+            PRIMARY KEY (id, created_at)) PARTITION BY RANGE (created_at)''',
+    'CREATE INDEX IF NOT EXISTS audit_log_chat_idx ON audit_log (chat_id, created_at DESC)',
+    'CREATE INDEX IF NOT EXISTS audit_log_user_idx ON audit_log (user_id, created_at DESC)',
+    '''CREATE TABLE IF NOT EXISTS chat_stats (
+            chat_id    BIGINT,
+            hour       TIMESTAMPTZ,
+            messages   INTEGER,
+            warns      INTEGER,
+            bans       INTEGER,
+            users      BYTEA,
+            posters    TEXT)''',
+    'CREATE INDEX IF NOT EXISTS chat_stats_chat_idx ON chat_stats (chat_id, hour)',
+    'CREATE INDEX IF NOT EXISTS chat_stats_hour_idx ON chat_stats (hour)',
+    '''CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            id         SERIAL PRIMARY KEY,
+            bot_name   TEXT,
+            method     TEXT,
+            args       TEXT,
+            due        DOUBLE PRECISION)''',
+    '''CREATE TABLE IF NOT EXISTS settings_templates (
+            name         TEXT PRIMARY KEY,
+            max_warn     SMALLINT,
+            time_ban     BIGINT,
+            mat_list     TEXT,
+            auto_warn    BOOLEAN,
+            welcome_mes  TEXT)''',
+    'ALTER TABLE settings_templates ADD COLUMN IF NOT EXISTS slow_rate_high INTEGER',
+    'ALTER TABLE settings_templates ADD COLUMN IF NOT EXISTS slow_rate_low INTEGER',
+    '''CREATE TABLE IF NOT EXISTS restrictions (
+            id          BIGSERIAL PRIMARY KEY,
+            chat_id     BIGINT,
+            user_id     BIGINT,
+            kind        TEXT,
+            until       TIMESTAMPTZ,
+            reason      TEXT,
+            created_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+            lifted_at   TIMESTAMPTZ)''',
+    # Только действующие ограничения: по времени окончания и по чату
+    'CREATE INDEX IF NOT EXISTS restrictions_until_idx ON restrictions (until) WHERE lifted_at IS NULL',
+    'CREATE INDEX IF NOT EXISTS restrictions_chat_idx ON restrictions (chat_id, user_id) WHERE lifted_at IS NULL',
+    '''CREATE TABLE IF NOT EXISTS polling_offsets (
+            bot_name   TEXT PRIMARY KEY,
+            update_id  BIGINT)''',
+    '''CREATE TABLE IF NOT EXISTS polling_inbox (
+            bot_name   TEXT,
+            update_id  BIGINT,
+            body       TEXT,
+            PRIMARY KEY (bot_name, update_id))''',
+)
+
+
+async def ensure_schema(conn: asyncpg.connection.Connection):
+    """
+    Создать недостающие таблицы, индексы и столбцы (см. SCHEMA) в одной транзакции.
+    """
+    async with conn.transaction():
+        for statement in SCHEMA:
+            await conn.execute(statement)
+    log.info('Схема базы данных обновлена.')
+
+
+async def create_pool(host: str, user: str, password: str,
+                      database: str, **kwargs) -> asyncpg.pool.Pool:
+    """
+    Создание пула соединений с базой данных PostgreSQL.
+    Используется фоновыми задачами, чтобы не занимать основное соединение.
+    """
+    pool = await asyncpg.create_pool(user=user, password=password,
+                                     database=database, host=host, **kwargs)
+
+    log.info(f'Пул соединений с базой данных {database} успешно создан.')
+    return pool
+
+
 async def gen_prepared_query(conn: asyncpg.connection.Connection) -> dict:
     """
     Генерация подготовленных выражений.
     """
     prepared_query = {
-        'welcome_select': await conn.prepare('SELECT welcome_mes FROM settings WHERE chat_id=$1'),
         'welcome_insert': await conn.prepare('INSERT INTO settings (chat_id) VALUES ($1)'),
         'warn_select': await conn.prepare(
                 'SELECT chat_id, user_id, warn_count FROM warn WHERE chat_id=$1 AND user_id=$2'),
         'warn_insert': await conn.prepare('INSERT INTO warn(chat_id, user_id, warn_count) VALUES($1, $2, 1)'''),
         'warn_update': await conn.prepare('UPDATE warn SET warn_count=warn_count+1 WHERE chat_id=$1 AND user_id=$2'),
-        'get_warn_settings': await conn.prepare('SELECT max_warn, time_ban FROM settings WHERE chat_id=$1'),
         'get_warn_count': await conn.prepare('SELECT warn_count FROM warn WHERE chat_id=$1 AND user_id=$2'),
         'warn_delete': await conn.prepare('DELETE FROM warn WHERE chat_id=$1 AND user_id=$2'),
         'get_settings': await conn.prepare(
-                'SELECT max_warn, time_ban, mat_list, auto_warn, welcome_mes FROM settings WHERE chat_id=$1')
+                'SELECT max_warn, time_ban, mat_list, auto_warn, welcome_mes, slow_rate_high, slow_rate_low '
+                'FROM settings WHERE chat_id=$1')
     }
     return prepared_query
+
+
+# Запросы только на чтение, которые можно выполнять на репликах. Первый параметр - chat_id
+READ_QUERIES = {
+    'welcome_select': 'SELECT welcome_mes FROM settings WHERE chat_id=$1',
+    'get_warn_settings': 'SELECT max_warn, time_ban FROM settings WHERE chat_id=$1',
+    'get_settings': 'SELECT max_warn, time_ban, mat_list, auto_warn, welcome_mes, slow_rate_high, slow_rate_low '
+                    'FROM settings WHERE chat_id=$1',
+    'filter_settings': 'SELECT mat_list, auto_warn FROM settings WHERE chat_id=$1',
+    'slow_settings': 'SELECT slow_rate_high, slow_rate_low FROM settings WHERE chat_id=$1',
+}
+
+# Отставание реплики в секундах; 0, если реплика применила все полученные изменения
+REPLICA_LAG = ('SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+               'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END AS lag')
+
+
+class ReadRouter:
+    """
+    Выполняет запросы на чтение на репликах по очереди.
+    Реплика, отстающая больше чем на max_lag секунд, недоступная или не ответившая
+    за timeout секунд, пропускается, а если подходящих реплик нет - запрос выполняется
+    на основной базе.
+    Чтения, которые должны видеть только что сделанную запись, сюда не передаются.
+    Результаты кешируются по chat_id на cache_ttl секунд; после записи настроек
+    кеш нужно сбросить через invalidate(). После этого чат читается с основной базы,
+    пока реплики могут не содержать записи (max_lag + interval секунд), иначе
+    в кеш попала бы прежняя строка с реплики.
+    """
+
+    def __init__(self, primary: asyncpg.pool.Pool, replicas: list, max_lag: float = 5, interval: float = 5,
+                 cache_ttl: float = 60, timeout: float = 1):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.interval = interval
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.healthy = list(replicas)
+        self._next = itertools.count()
+        # chat_id -> {имя запроса: (время устаревания, строки)}
+        self.cache = {}
+        # chat_id -> до какого времени читать с основной базы; None - все чаты
+        self.pinned = {}
+
+    def evict(self, fraction: float):
+        """
+        Удалить из кеша долю fraction самых старых записей.
+        """
+        for chat_id in list(self.cache)[:max(1, int(len(self.cache) * fraction))]:
+            del self.cache[chat_id]
+
+    def invalidate(self, chat_ids=None):
+        """
+        Сбросить кеш для перечисленных чатов или, если chat_ids=None, для всех сразу.
+        """
+        now = time.monotonic()
+        until = now + self.max_lag + self.interval
+        self.pinned = {key: value for key, value in self.pinned.items() if value > now}
+        if chat_ids is None:
+            self.cache = {}
+            self.pinned[None] = until
+            return
+        for chat_id in chat_ids:
+            self.cache.pop(chat_id, None)
+            self.pinned[chat_id] = until
+
+    def _is_pinned(self, chat_id: int, now: float) -> bool:
+        return self.pinned.get(chat_id, 0) > now or self.pinned.get(None, 0) > now
+
+    async def fetch(self, name: str, chat_id: int, *args) -> list:
+        """
+        Выполнить запрос READ_QUERIES[name]. Подготовленные выражения кешируются
+        asyncpg для каждого соединения пула.
+        """
+        cached = self.cache.get(chat_id, {}).get(name)
+        now = time.monotonic()
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        if self.replicas and self._is_pinned(chat_id, now):
+            rows = await self.primary.fetch(READ_QUERIES[name], chat_id, *args)
+        else:
+            rows = await self._fetch(READ_QUERIES[name], chat_id, *args)
+        self.cache.setdefault(chat_id, {})[name] = now + self.cache_ttl, rows
+        return rows
+
+    async def _fetch(self, query: str, *args) -> list:
+        for _ in range(len(self.healthy)):
+            healthy = self.healthy
+            if not healthy:
+                break
+            replica = healthy[next(self._next) % len(healthy)]
+            try:
+                # Реплика может перестать отвечать, не закрывая соединение
+                return await replica.fetch(query, *args, timeout=self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError,
+                    asyncpg.InterfaceError) as error:
+                log.warning(f'Реплика недоступна, чтение с основной базы: {error}')
+                self.healthy = [pool for pool in healthy if pool is not replica]
+        return await self.primary.fetch(query, *args)
+
+    async def _lag(self, replica: asyncpg.pool.Pool) -> float:
+        try:
+            return await replica.fetchval(REPLICA_LAG, timeout=self.interval) or 0
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError):
+            return float('inf')
+
+    async def monitor(self):
+        """
+        Фоновая задача: раз в interval секунд проверяет отставание реплик.
+        """
+        while True:
+            lags = [await self._lag(replica) for replica in self.replicas]
+            self.healthy = [replica for replica, lag in zip(self.replicas, lags) if lag <= self.max_lag]
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,64 @@
+"""
+Сохранение отложенных вызовов call_later между перезапусками.
+Сохраняются только вызовы методов ботов (например, удаление сообщения об ошибке).
+"""
+import asyncio
+import json
+import logging
+import time
+
+import asyncpg
+
+from bot.call_later import call_later, pending
+
+log = logging.getLogger('aiogram')
+
+
+async def save_jobs(con: asyncpg.connection.Connection, tenants: list):
+    """
+    Отменить отложенные вызовы методов ботов и записать их в таблицу scheduled_jobs.
+    """
+    names = {tenant.bot: tenant.name for tenant in tenants}
+    records = []
+    for future, (due, callable, args) in list(pending.items()):
+        name = names.get(getattr(callable, '__self__', None))
+        if name is None:
+            continue
+        future.cancel()
+        records.append((name, callable.__name__, json.dumps(args), due))
+    if records:
+        await con.copy_records_to_table('scheduled_jobs', records=records,
+                                        columns=('bot_name', 'method', 'args', 'due'))
+    log.info(f'Сохранено отложенных вызовов: {len(records)}')
+
+
+async def restore_jobs(con: asyncpg.connection.Connection, tenants: list, loop):
+    """
+    Забрать сохраненные вызовы из scheduled_jobs и запланировать их заново.
+    """
+    bots = {tenant.name: tenant.bot for tenant in tenants}
+    rows = await con.fetch('DELETE FROM scheduled_jobs WHERE bot_name = ANY($1::text[]) '
+                           'RETURNING bot_name, method, args, due', list(bots))
+    now = time.time()
+    for row in rows:
+        method = getattr(bots[row['bot_name']], row['method'])
+        call_later(max(row['due'] - now, 0), method, *json.loads(row['args']), loop=loop)
+    if rows:
+        log.info(f'Восстановлено отложенных вызовов: {len(rows)}')
+
+
+async def restore_jobs_during_handoff(pool: asyncpg.pool.Pool, tenants: list, loop,
+                                      window: float, interval: float = 2):
+    """
+    Забирать сохраненные вызовы еще window секунд после запуска.
+    При перезапуске без простоя новый процесс стартует раньше, чем старый
+    выполнит save_jobs при остановке, поэтому одной проверки при запуске мало.
+    """
+    deadline = time.monotonic() + window
+    while time.monotonic() < deadline:
+        await asyncio.sleep(interval)
+        try:
+            async with pool.acquire() as con:
+                await restore_jobs(con, tenants, loop)
+        except (OSError, asyncpg.PostgresError):
+            log.exception('Не удалось восстановить отложенные вызовы')
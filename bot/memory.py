@@ -0,0 +1,177 @@
+"""
+Учет памяти кешей и хранилищ бота и ограничение их размера.
+"""
+import asyncio
+import itertools
+import logging
+import resource
+import sys
+import time
+import tracemalloc
+
+log = logging.getLogger('aiogram')
+
+# Сколько записей контейнера измерять для оценки его размера
+SAMPLE_SIZE = 50
+
+
+def deep_size(obj, seen: set = None) -> int:
+    """
+    Приблизительный размер объекта вместе со всем, на что он ссылается, в байтах.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_size(vars(obj), seen)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_size(getattr(obj, name), seen) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+
+def estimate_size(container) -> int:
+    """
+    Оценка размера контейнера по выборке из SAMPLE_SIZE записей.
+    """
+    count = len(container)
+    if not count:
+        return sys.getsizeof(container)
+    items = container.items() if isinstance(container, dict) else container
+    sample = list(itertools.islice(items, SAMPLE_SIZE))
+    return sys.getsizeof(container) + deep_size(sample) * count // len(sample)
+
+
+def rss() -> int:
+    """
+    Текущий RSS процесса в байтах (пиковый, если /proc недоступен).
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Tracked:
+    """
+    Кеш или хранилище под учетом.
+    container - функция, возвращающая измеряемый контейнер,
+    evict(fraction) - функция (или корутина), освобождающая примерно такую долю записей,
+    budget - собственный лимит в байтах.
+    """
+
+    def __init__(self, name: str, container, evict=None, budget: int = None):
+        self.name = name
+        self.container = container
+        self.evict = evict
+        self.budget = budget
+
+    def report(self) -> dict:
+        container = self.container()
+        return {'name': self.name, 'entries': len(container), 'bytes': estimate_size(container),
+                'budget': self.budget}
+
+
+class MemoryBudget:
+    """
+    Следит, чтобы каждый кеш укладывался в свой лимит, а все вместе - в общий.
+    При превышении вытесняет записи, начиная с самого большого кеша.
+    """
+
+    def __init__(self, budget: int, interval: float = 60):
+        self.budget = budget
+        self.interval = interval
+        self.tracked = []
+        # Сколько раз вытеснялись записи из каждого кеша
+        self.evictions = {}
+
+    def track(self, name: str, container, evict=None, budget: int = None):
+        self.tracked.append(Tracked(name, container, evict, budget))
+
+    def report(self) -> list:
+        return [tracked.report() for tracked in self.tracked]
+
+    async def _evict(self, tracked: Tracked, fraction: float):
+        result = tracked.evict(fraction)
+        if asyncio.iscoroutine(result):
+            await result
+        self.evictions[tracked.name] = self.evictions.get(tracked.name, 0) + 1
+
+    async def enforce(self):
+        """
+        Проверить лимиты и вытеснить лишнее.
+        """
+        sizes = {}
+        for tracked in self.tracked:
+            size = estimate_size(tracked.container())
+            if tracked.evict and tracked.budget and size > tracked.budget:
+                await self._evict(tracked, 1 - tracked.budget / size)
+                size = estimate_size(tracked.container())
+            sizes[tracked] = size
+        total = sum(sizes.values())
+        for tracked in sorted(sizes, key=sizes.get, reverse=True):
+            if total <= self.budget:
+                break
+            if tracked.evict and sizes[tracked]:
+                await self._evict(tracked, min(1, (total - self.budget) / sizes[tracked]))
+                size = estimate_size(tracked.container())
+                total -= sizes[tracked] - size
+        if total > self.budget:
+            log.warning(f'Кеши занимают {total} байт при лимите {self.budget}')
+
+    async def run(self):
+        """
+        Фоновая задача: проверять лимиты раз в interval секунд.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.enforce()
+
+
+def evict_storage(storage, fraction: float, idle: float = 60):
+    """
+    Удалить из MemoryStorage записи пользователей без состояния и данных,
+    к которым не было обращений (throttle) дольше idle секунд.
+    Такие записи остаются после каждого вызова Dispatcher.throttle.
+    Если этого меньше доли fraction всех записей, удаляются и более свежие записи
+    без состояния, начиная с самых давних, пока доля не будет набрана.
+    """
+    now = time.time()
+    total = sum(len(users) for users in storage.data.values())
+    target = max(1, int(total * fraction))
+    candidates = []
+    for chat, users in storage.data.items():
+        for user, record in users.items():
+            if record.get('state') is None and not record.get('data'):
+                # Время последнего вызова throttle хранится в корзине под ключом called_at
+                calls = [bucket.get('called_at', 0) for bucket in (record.get('bucket') or {}).values()]
+                candidates.append((max(calls, default=0), chat, user))
+    candidates.sort(key=lambda candidate: candidate[0])
+    for index, (called_at, chat, user) in enumerate(candidates):
+        if index >= target and called_at >= now - idle:
+            break
+        users = storage.data[chat]
+        del users[user]
+        if not users:
+            del storage.data[chat]
+
+
+def trace(action: str = None, limit: int = 10) -> list:
+    """
+    Управление tracemalloc: 'start', 'stop' или None - топ мест выделения памяти.
+    """
+    if action == 'start':
+        tracemalloc.start()
+        return []
+    if action == 'stop':
+        tracemalloc.stop()
+        return []
+    if not tracemalloc.is_tracing():
+        return []
+    return [str(stat) for stat in tracemalloc.take_snapshot().statistics('lineno')[:limit]]
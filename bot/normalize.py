@@ -0,0 +1,104 @@
+import re
+
+# Латинские буквы, похожие на кириллические, и замены цифр/символов (leetspeak)
+_HOMOGLYPHS = {
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м', 'n': 'п',
+    'o': 'о', 'p': 'р', 'r': 'г', 't': 'т', 'u': 'и', 'x': 'х', 'y': 'у', 'ё': 'е',
+    '0': 'о', '3': 'з', '4': 'ч', '6': 'б', '8': 'в', '@': 'а', '$': 'с',
+}
+# Символы, которыми разделяют буквы запрещенного слова: заменяются на '_'
+_SEPARATORS = '.,-_*|/\\~+\'"`^:;!?#'
+
+# Таблица строится один раз при импорте модуля. Список по кодам символов работает
+# в str.translate быстрее словаря; символы за его пределами остаются без изменений.
+_TABLE = list(range(0x500))
+for _char, _replace in {**_HOMOGLYPHS, **{sep: '_' for sep in _SEPARATORS}}.items():
+    _TABLE[ord(_char)] = _replace
+_REPEATS = re.compile(r'(.)\1+')
+# Одиночные буквы, разделенные пробелами (с л о в о)
+_LETTERS = re.compile(r'(?<!\w)(\w)\s+(?=\w(?!\w))')
+# Цепочка одиночных букв через пробелы или разделители (с л о в о, с.л.о.в.о)
+_RUN = re.compile(r'(?<![^\W_])[^\W_](?:[\s_]+[^\W_](?![^\W_]))+')
+_RUN_SPLIT = re.compile(r'[\s_]+')
+_WORD = re.compile(r'\w+')
+_PART = re.compile(r'[^\W_]+')
+
+
+def _fold(text: str) -> str:
+    return _REPEATS.sub(r'\1', text.lower().translate(_TABLE))
+
+
+def normalize(text: str) -> str:
+    """
+    Привести текст к каноническому виду: нижний регистр, замена похожих символов,
+    единый разделитель вместо знаков препинания, склейка букв через пробел
+    и схлопывание повторяющихся букв.
+    """
+    text = text.lower().translate(_TABLE)
+    return _REPEATS.sub(r'\1', _LETTERS.sub(r'\1', text))
+
+
+def _join_run(run: str) -> str:
+    """
+    Склеить цепочку одиночных букв в одну строку.
+    Повторы букв схлопываются и через пробел (с л о о в о).
+    """
+    return _REPEATS.sub(r'\1', _RUN_SPLIT.sub('', run))
+
+
+def _words(text: str) -> set:
+    words = set(_WORD.findall(text.replace('_', '')))
+    words.update(_PART.findall(text))
+    return words
+
+
+def message_words(text: str) -> frozenset:
+    """
+    Множество слов нормализованного текста.
+    Слова с разделителями (с.л.о.в.о) попадают в него и склеенными, и по частям.
+    """
+    return frozenset(_words(_fold(text)))
+
+
+def find_forbidden(text: str, forbidden: frozenset) -> frozenset:
+    """
+    Запрещенные слова, найденные в тексте.
+    Границу слова в цепочке одиночных букв не определить ('с л о в о и' - слово и союз),
+    поэтому в склеенной цепочке ищутся запрещенные слова как подстроки: время
+    растет линейно с длиной цепочки, а не с количеством возможных слов в ней.
+    """
+    text = _fold(text)
+    found = forbidden & _words(text)
+    if ' ' in text or '_' in text:
+        for run in _RUN.findall(text):
+            joined = _join_run(run)
+            found |= {word for word in forbidden if word in joined}
+    return found
+
+
+# mat_list -> нормализованное множество запрещенных слов
+forbidden_cache = {}
+FORBIDDEN_CACHE_SIZE = 1024
+
+
+def forbidden_words(mat_list: str) -> frozenset:
+    """
+    Нормализованное множество запрещенных слов чата.
+    Результат кешируется по строке mat_list, поэтому разбор выполняется один раз.
+    """
+    words = forbidden_cache.get(mat_list)
+    if words is None:
+        words = frozenset(normalize(word.strip()).replace('_', '') for word in mat_list.split(',') if word.strip())
+        if len(forbidden_cache) >= FORBIDDEN_CACHE_SIZE:
+            # Вытеснить самую старую запись
+            del forbidden_cache[next(iter(forbidden_cache))]
+        forbidden_cache[mat_list] = words
+    return words
+
+
+def evict_forbidden(fraction: float):
+    """
+    Удалить из кеша запрещенных слов долю fraction самых старых записей.
+    """
+    for mat_list in list(forbidden_cache)[:max(1, int(len(forbidden_cache) * fraction))]:
+        del forbidden_cache[mat_list]
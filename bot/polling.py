@@ -0,0 +1,148 @@
+"""
+Получение обновлений через long polling - для запуска без публичного HTTPS-адреса.
+"""
+import asyncio
+import logging
+
+import aiohttp
+import asyncpg
+from aiogram import types
+from aiogram.utils import context, json
+from aiogram.utils.exceptions import TelegramAPIError
+
+log = logging.getLogger('aiogram')
+
+# Пачка и новое смещение записываются одним запросом, поэтому смещение не опережает пачку
+STORE_BATCH = ('WITH stored AS (INSERT INTO polling_inbox (bot_name, update_id, body) '
+               'SELECT $1::text, * FROM unnest($2::bigint[], $3::text[]) ON CONFLICT DO NOTHING) '
+               'INSERT INTO polling_offsets (bot_name, update_id) VALUES ($1, $4) '
+               'ON CONFLICT (bot_name) DO UPDATE SET update_id=EXCLUDED.update_id')
+
+
+class Poller:
+    """
+    Получает обновления одного бота через getUpdates и передает их его диспетчеру.
+    Полученная пачка сначала записывается в polling_inbox вместе с новым смещением,
+    и следующий getUpdates сразу отправляется с этим смещением: Telegram считает
+    пачку подтвержденной, а ожидание новых обновлений идет параллельно с ее обработкой.
+    Обработанное обновление удаляется из polling_inbox, а после перезапуска
+    оставшиеся в ней обрабатываются первыми. Поэтому обновления не теряются
+    и не повторяются, кроме тех, что были в обработке при аварийном завершении.
+    """
+
+    def __init__(self, tenant, pool: asyncpg.pool.Pool, timeout: int = 20, limit: int = 100):
+        self.tenant = tenant
+        self.pool = pool
+        self.timeout = timeout
+        self.limit = limit
+        self.offset = None
+        self.running = False
+        self._task = None
+        self._poll = None
+
+    async def _load(self) -> list:
+        """
+        Прочитать смещение и обновления, полученные, но не обработанные до перезапуска.
+        """
+        self.offset = await self.pool.fetchval('SELECT update_id FROM polling_offsets WHERE bot_name=$1',
+                                               self.tenant.name)
+        rows = await self.pool.fetch('SELECT body FROM polling_inbox WHERE bot_name=$1 ORDER BY update_id',
+                                     self.tenant.name)
+        return [types.Update(**json.loads(row['body'])) for row in rows]
+
+    async def _store(self, updates: list, offset: int) -> bool:
+        """
+        Записать пачку и смещение после нее. False - пачку подтверждать нельзя.
+        """
+        try:
+            await self.pool.execute(STORE_BATCH, self.tenant.name,
+                                    [update.update_id for update in updates],
+                                    [json.dumps(update.to_python()) for update in updates], offset)
+        except (OSError, asyncpg.PostgresError):
+            log.exception(f'Не удалось сохранить обновления бота {self.tenant.name}')
+            return False
+        return True
+
+    async def _done(self, update_id: int):
+        try:
+            await self.pool.execute('DELETE FROM polling_inbox WHERE bot_name=$1 AND update_id=$2',
+                                    self.tenant.name, update_id)
+        except (OSError, asyncpg.PostgresError):
+            log.exception(f'Не удалось отметить обновление {update_id} бота {self.tenant.name}')
+
+    async def _get_updates(self, offset: int) -> list:
+        try:
+            return await self.tenant.bot.get_updates(offset=offset, limit=self.limit, timeout=self.timeout)
+        except (TelegramAPIError, aiohttp.ClientError, asyncio.TimeoutError):
+            log.exception(f'Ошибка getUpdates бота {self.tenant.name}')
+            await asyncio.sleep(1)
+            return []
+
+    async def _process(self, update):
+        try:
+            return await self.tenant.dp.process_update(update)
+        finally:
+            # Обновление, на котором обработчик упал, тоже не обрабатывается повторно
+            await self._done(update.update_id)
+
+    async def _dispatch(self, updates: list):
+        self.tenant.metrics['updates'] += len(updates)
+        results = await asyncio.gather(*(self._process(update) for update in updates), return_exceptions=True)
+        for update, result in zip(updates, results):
+            if isinstance(result, Exception):
+                log.error(f'Ошибка обработки обновления {update.update_id}', exc_info=result)
+
+    async def run(self):
+        """
+        Цикл получения и обработки обновлений.
+        """
+        # Обработчики получают бота и диспетчер из контекста так же, как при webhook'е
+        context.set_value('dispatcher', self.tenant.dp)
+        context.set_value('bot', self.tenant.bot)
+        # getUpdates не работает, пока установлен webhook
+        await self.tenant.bot.delete_webhook()
+        pending = await self._load()
+        if pending:
+            log.info(f'Обработка {len(pending)} обновлений бота {self.tenant.name}, сохраненных до перезапуска')
+            await self._dispatch(pending)
+        self._poll = asyncio.ensure_future(self._get_updates(self.offset))
+        while self.running:
+            try:
+                updates = await self._poll
+            except asyncio.CancelledError:
+                if self.running:
+                    raise
+                break
+            # Уже сохраненные, если Telegram прислал их снова
+            if self.offset is not None:
+                updates = [update for update in updates if update.update_id >= self.offset]
+            if updates:
+                offset = updates[-1].update_id + 1
+                if not await self._store(updates, offset):
+                    # Без записи пачку нельзя подтверждать: запросить ее снова
+                    await asyncio.sleep(1)
+                    self._poll = asyncio.ensure_future(self._get_updates(self.offset))
+                    continue
+                self.offset = offset
+            # Следующая пачка запрашивается до обработки текущей и подтверждает ее
+            self._poll = asyncio.ensure_future(self._get_updates(self.offset))
+            if updates:
+                await self._dispatch(updates)
+
+    def start(self, loop):
+        self.running = True
+        self._task = loop.create_task(self.run())
+
+    async def stop(self):
+        """
+        Прекратить получение обновлений и дождаться обработки текущей пачки.
+        Ответ на прерванный getUpdates не подтвержден и будет получен снова после перезапуска.
+        """
+        self.running = False
+        if self._poll is not None:
+            self._poll.cancel()
+        if self._task is not None:
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,96 @@
+import asyncio
+import datetime
+import logging
+
+import asyncpg
+
+log = logging.getLogger('aiogram')
+
+# Виды ограничений
+BAN, MUTE = 'ban', 'mute'
+
+
+def _timestamp(until: int = None) -> datetime.datetime:
+    return None if until is None else datetime.datetime.fromtimestamp(until, datetime.timezone.utc)
+
+
+class Restrictions:
+    """
+    Учет выданных блокировок и запретов писать в таблице restrictions.
+    Активные записи (lifted_at IS NULL) проиндексированы по времени окончания,
+    поэтому истекшие снимаются одним UPDATE фоновой задачей.
+    until = NULL - ограничение навсегда.
+    """
+
+    def __init__(self, pool: asyncpg.pool.Pool, interval: float = 60):
+        self.pool = pool
+        self.interval = interval
+
+    async def add(self, chat_id: int, user_id: int, kind: str, until: int = None, reason: str = None):
+        """
+        Записать ограничение (until - unix-время окончания). Прежнее активное
+        ограничение того же вида для пользователя считается замененным.
+        """
+        try:
+            await self.pool.execute('WITH replaced AS (UPDATE restrictions SET lifted_at=now() '
+                                    'WHERE chat_id=$1 AND user_id=$2 AND kind=$3 AND lifted_at IS NULL) '
+                                    'INSERT INTO restrictions (chat_id, user_id, kind, until, reason) '
+                                    'VALUES ($1, $2, $3, $4, $5)',
+                                    chat_id, user_id, kind, _timestamp(until), reason)
+        except (OSError, asyncpg.PostgresError):
+            log.exception(f'Не удалось записать ограничение {kind} для {user_id} в чате {chat_id}')
+
+    async def active(self, chat_id: int, limit: int = 50) -> list:
+        """
+        Действующие ограничения в чате, ближайшие к окончанию первыми.
+        """
+        return await self.pool.fetch('SELECT user_id, kind, until, reason, created_at FROM restrictions '
+                                     'WHERE chat_id=$1 AND lifted_at IS NULL AND (until IS NULL OR until > now()) '
+                                     'ORDER BY until NULLS LAST LIMIT $2', chat_id, limit)
+
+    async def pending(self, chat_id: int, user_ids: list = None) -> list:
+        """
+        Неснятые ограничения перечисленных пользователей (всех, если user_ids=None), включая
+        истекшие, но еще не отмеченные фоновой задачей. Возвращает записи (user_id, kind).
+        """
+        query = 'SELECT user_id, kind FROM restrictions WHERE chat_id=$1 AND lifted_at IS NULL'
+        args = [chat_id]
+        if user_ids is not None:
+            query += ' AND user_id = ANY($2::bigint[])'
+            args.append(user_ids)
+        return await self.pool.fetch(query, *args)
+
+    async def lift(self, chat_id: int, user_ids: list = None, kinds: tuple = (BAN, MUTE)) -> list:
+        """
+        Отметить снятыми ограничения перечисленных пользователей (всех, если user_ids=None)
+        одним запросом. Возвращает снятые записи (user_id, kind).
+        """
+        query = ('UPDATE restrictions SET lifted_at=now() WHERE chat_id=$1 AND kind = ANY($2::text[]) '
+                 'AND lifted_at IS NULL')
+        args = [chat_id, list(kinds)]
+        if user_ids is not None:
+            query += ' AND user_id = ANY($3::bigint[])'
+            args.append(user_ids)
+        return await self.pool.fetch(query + ' RETURNING user_id, kind', *args)
+
+    async def reconcile(self) -> int:
+        """
+        Отметить снятыми все истекшие ограничения. Возвращает их количество.
+        """
+        result = await self.pool.execute('UPDATE restrictions SET lifted_at=until '
+                                         'WHERE lifted_at IS NULL AND until <= now()')
+        return int(result.split()[-1])
+
+    async def run(self):
+        """
+        Фоновая задача: раз в interval секунд снимать истекшие ограничения.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                expired = await self.reconcile()
+            except (OSError, asyncpg.PostgresError):
+                log.exception('Не удалось снять истекшие ограничения')
+                continue
+            if expired:
+                log.info(f'Снято истекших ограничений: {expired}')
@@ -0,0 +1,134 @@
+"""
+Массовая работа с настройками чатов: шаблоны, экспорт и импорт.
+"""
+import csv
+import io
+import json
+
+import asyncpg
+
+# Переносимые столбцы таблицы settings
+COLUMNS = ('chat_id', 'max_warn', 'time_ban', 'auto_warn', 'welcome_mes', 'mat_list',
+           'slow_rate_high', 'slow_rate_low')
+TEMPLATE_COLUMNS = COLUMNS[1:]
+# Столбцы, где NULL - осмысленное значение (приветствие и фильтр выключены).
+# Остальные при импорте без значения сохраняют текущее значение или значение по умолчанию
+NULLABLE_COLUMNS = ('welcome_mes', 'mat_list')
+
+FORMATS = ('csv', 'jsonl')
+
+
+async def save_template(con: asyncpg.connection.Connection, name: str, chat_id: int) -> bool:
+    """
+    Сохранить настройки чата как шаблон name (существующий шаблон перезаписывается).
+    """
+    columns = ', '.join(TEMPLATE_COLUMNS)
+    updates = ', '.join(f'{column}=EXCLUDED.{column}' for column in TEMPLATE_COLUMNS)
+    result = await con.execute(f'INSERT INTO settings_templates (name, {columns}) '
+                               f'SELECT $1, {columns} FROM settings WHERE chat_id=$2 '
+                               f'ON CONFLICT (name) DO UPDATE SET {updates}', name, chat_id)
+    return result != 'INSERT 0 0'
+
+
+async def apply_template(con: asyncpg.connection.Connection, name: str, chat_ids: list = None) -> list:
+    """
+    Применить шаблон к перечисленным чатам (или ко всем, если chat_ids=None) одним UPDATE.
+    Возвращает id измененных чатов.
+    """
+    updates = ', '.join(f'{column}=t.{column}' for column in TEMPLATE_COLUMNS)
+    query = f'UPDATE settings s SET {updates} FROM settings_templates t WHERE t.name=$1'
+    args = [name]
+    if chat_ids is not None:
+        query += ' AND s.chat_id = ANY($2::bigint[])'
+        args.append(chat_ids)
+    rows = await con.fetch(query + ' RETURNING s.chat_id', *args)
+    return [row['chat_id'] for row in rows]
+
+
+async def export_settings(con: asyncpg.connection.Connection, fmt: str) -> bytes:
+    """
+    Выгрузить настройки всех чатов через COPY в формате csv или jsonl.
+    """
+    buffer = io.BytesIO()
+
+    async def write(chunk):
+        buffer.write(chunk)
+
+    query = f"SELECT {', '.join(COLUMNS)} FROM settings ORDER BY chat_id"
+    if fmt == 'csv':
+        await con.copy_from_query(query, output=write, format='csv', header=True)
+    else:
+        # JSON не содержит управляющих символов, поэтому с такими кавычками и разделителем
+        # COPY выводит строки row_to_json без изменений
+        await con.copy_from_query(f'SELECT row_to_json(s) FROM ({query}) s', output=write,
+                                  format='csv', quote='\x01', delimiter='\x02')
+    return buffer.getvalue()
+
+
+def _record(row: dict) -> tuple:
+    """
+    Привести значения строки импорта к типам столбцов settings.
+    Пустые строки CSV считаются NULL. Неверная строка - ValueError.
+    """
+    if not isinstance(row, dict) or row.get('chat_id') in (None, ''):
+        raise ValueError(f'Строка без chat_id: {row!r}')
+
+    def value(column):
+        item = row.get(column)
+        return None if item == '' else item
+
+    def number(column):
+        item = value(column)
+        return None if item is None else int(item)
+
+    auto_warn = value('auto_warn')
+    if isinstance(auto_warn, str):
+        auto_warn = auto_warn.lower() in ('t', 'true', '1')
+    record = (int(row['chat_id']),
+              number('max_warn'),
+              number('time_ban'),
+              auto_warn,
+              value('welcome_mes'),
+              value('mat_list'),
+              number('slow_rate_high'),
+              number('slow_rate_low'))
+    max_warn, time_ban = record[1:3]
+    if (max_warn is not None and max_warn < 1) or (time_ban is not None and time_ban < 0):
+        raise ValueError(f'Недопустимые значения: {row!r}')
+    return record
+
+
+def parse_settings(data: bytes, fmt: str) -> tuple:
+    """
+    Разобрать файл импорта. Возвращает столбцы, которые есть в файле, и список записей settings.
+    """
+    text = data.decode('utf-8')
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        rows = list(reader)
+        present = set(reader.fieldnames or ())
+    else:
+        rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+        present = {column for row in rows if isinstance(row, dict) for column in row}
+    records = [_record(row) for row in rows]
+    return tuple(column for column in COLUMNS if column in present), records
+
+
+async def import_settings(con: asyncpg.connection.Connection, records: list, present: tuple = COLUMNS) -> list:
+    """
+    Загрузить записи через COPY во временную таблицу и добавить или обновить настройки чатов.
+    Новые чаты получают значения по умолчанию для отсутствующих в файле значений,
+    у существующих такие значения не меняются. Возвращает id измененных чатов.
+    """
+    updates = ', '.join(f'{column}=i.{column}' if column in NULLABLE_COLUMNS
+                        else f'{column}=COALESCE(i.{column}, s.{column})'
+                        for column in TEMPLATE_COLUMNS if column in present)
+    async with con.transaction():
+        await con.execute('CREATE TEMPORARY TABLE settings_import (LIKE settings INCLUDING DEFAULTS) ON COMMIT DROP')
+        await con.copy_records_to_table('settings_import', records=records, columns=COLUMNS)
+        await con.execute('INSERT INTO settings (chat_id) SELECT chat_id FROM settings_import ON CONFLICT DO NOTHING')
+        if not updates:
+            return [record[0] for record in records]
+        rows = await con.fetch(f'UPDATE settings s SET {updates} FROM settings_import i '
+                               f'WHERE s.chat_id = i.chat_id RETURNING s.chat_id')
+    return [row['chat_id'] for row in rows]
@@ -0,0 +1,149 @@
+import asyncio
+import collections
+import time
+
+# Приоритеты обновлений
+ADMIN, COMMAND, MODERATION, COSMETIC = 'admin', 'command', 'moderation', 'cosmetic'
+
+ADMIN_COMMANDS = ('!ban', '!mute', '!unmute', '!warn', '!acquit', '!pin', '!settings', '!sd_ch',
+                  '!audit', '!stats', '!load', '!template', '!export', '!import',
+                  '!memory', '!restrictions', '!lift')
+
+
+class MemberStatusCache:
+    """
+    Статусы участников чатов (creator, administrator, member...), полученные
+    через get_chat_member, хранятся ttl секунд.
+    """
+
+    def __init__(self, ttl: float = 300, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = {}
+
+    def get(self, chat_id: int, user_id: int) -> str:
+        entry = self.entries.get((chat_id, user_id))
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, chat_id: int, user_id: int, status: str):
+        if len(self.entries) >= self.max_size:
+            del self.entries[next(iter(self.entries))]
+        self.entries[chat_id, user_id] = time.monotonic() + self.ttl, status
+
+
+def classify(update, statuses: MemberStatusCache = None, owner: int = None) -> str:
+    """
+    Определить приоритет обновления.
+    Команды и нажатия кнопок настроек от владельца бота или известных администраторов - ADMIN,
+    те же команды от пользователей, чей статус еще не проверен, - COMMAND,
+    от известных не-администраторов - MODERATION,
+    остальные сообщения - MODERATION: и стикеры с фото учитываются в скорости чата
+    (SlowModeGuard) и в AntiFlood, поэтому флуд медиа не отбрасывается до них,
+    все остальное (редактирования, посты каналов и т.д.) - COSMETIC.
+    """
+    if update.callback_query:
+        call = update.callback_query
+        chat_id = call.message.chat.id if call.message else None
+        user_id = call.from_user.id
+    else:
+        message = update.message
+        if message is None:
+            return COSMETIC
+        if not (message.text and message.text.startswith(ADMIN_COMMANDS)):
+            return MODERATION
+        chat_id, user_id = message.chat.id, message.from_user.id
+    if user_id == owner:
+        return ADMIN
+    status = statuses.get(chat_id, user_id) if statuses is not None else None
+    if status is None:
+        return COMMAND
+    return ADMIN if status in ('creator', 'administrator') else MODERATION
+
+
+class LoadShedder:
+    """
+    Следит за нагрузкой: количеством обновлений в обработке и задержкой event loop.
+    При перегрузке второстепенная работа отбрасывается, а обычные обновления
+    ждут свободного места, пропуская вперед команды администраторов.
+    Команды от непроверенных пользователей идут вне очереди, только пока
+    свободно одно из command_slots мест, иначе - в общую очередь.
+    """
+
+    def __init__(self, max_in_flight: int = 100, max_lag: float = 0.5, interval: float = 0.1,
+                 command_slots: int = 10, status_ttl: float = 300):
+        self.max_in_flight = max_in_flight
+        self.max_lag = max_lag
+        self.interval = interval
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.command_slots = asyncio.Semaphore(command_slots)
+        # Статусы участников: по ним команды администраторов отличаются от подделок
+        self.statuses = MemberStatusCache(status_ttl)
+        self.in_flight = 0
+        self.waiting = 0
+        self.lag = 0.0
+        # False - процесс завершается и новые обновления не принимает
+        self.accepting = True
+        # (метка бота, что отброшено) -> количество
+        self.shed = collections.Counter()
+
+    @property
+    def overloaded(self) -> bool:
+        return self.waiting > 0 or self.in_flight >= self.max_in_flight or self.lag > self.max_lag
+
+    def allow(self, what: str, label: str = None) -> bool:
+        """
+        Можно ли выполнить второстепенную работу what. При перегрузке - нет, отказ учитывается.
+        """
+        if self.overloaded:
+            self.shed[label, what] += 1
+            return False
+        return True
+
+    async def run(self, priority: str, coro, label: str = None):
+        """
+        Выполнить обработку обновления с учетом его приоритета.
+        """
+        if priority == COSMETIC and not self.allow(COSMETIC, label):
+            coro.close()
+            return None
+        self.in_flight += 1
+        try:
+            if priority == ADMIN:
+                return await coro
+            if priority == COMMAND and not self.command_slots.locked():
+                async with self.command_slots:
+                    return await coro
+            self.waiting += 1
+            try:
+                await self.slots.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                return await coro
+            finally:
+                self.slots.release()
+        finally:
+            self.in_flight -= 1
+
+    async def drain(self, timeout: float) -> bool:
+        """
+        Перестать принимать обновления и дождаться окончания обработки текущих,
+        но не дольше timeout секунд. Возвращает True, если все обновления обработаны.
+        """
+        self.accepting = False
+        deadline = time.monotonic() + timeout
+        while self.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return not self.in_flight
+
+    async def monitor(self):
+        """
+        Фоновая задача: измеряет задержку event loop (сглаженно).
+        """
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - start - self.interval
+            self.lag += (lag - self.lag) * 0.3
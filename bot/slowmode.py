@@ -0,0 +1,127 @@
+"""
+Отслеживание скорости сообщений в чатах и автоматический режим ограничений при флуде.
+"""
+import time
+
+# Изменения режима, которые возвращает SlowMode.update
+LOCK, UNLOCK = 'lock', 'unlock'
+
+
+class ChatRate:
+    """
+    Счетчики одного чата: сообщения за последние секунды (кольцевой буфер),
+    средняя скорость в сообщениях в минуту и время включения режима ограничений.
+    """
+    __slots__ = ('counts', 'second', 'rate', 'high', 'low', 'locked', 'since')
+
+    def __init__(self, window: int, second: int):
+        self.counts = [0] * window
+        self.second = second
+        self.rate = 0.0
+        self.high = None
+        self.low = None
+        self.locked = False
+        self.since = 0
+
+
+class SlowMode:
+    """
+    Скорость сообщений в каждом чате - среднее посекундных счетчиков за все
+    закрытые секунды кольцевого буфера, поэтому одна всплеск-секунда не включает
+    режим ограничений. Если скорость выше порога high, чат переходит в режим
+    ограничений и остается в нем не меньше hold секунд, а выходит, только когда
+    скорость опустится ниже low.
+    На каждое сообщение - несколько арифметических операций; пороги проверяются
+    не чаще раза в секунду на чат.
+    """
+
+    def __init__(self, window: int = 10, hold: int = 60, max_chats: int = 10000):
+        if window < 2:
+            raise ValueError('window должен быть не меньше 2 секунд')
+        self.window = window
+        self.hold = hold
+        self.max_chats = max_chats
+        self.chats = {}
+
+    def _roll(self, chat: ChatRate, now: int):
+        """
+        Закрыть прошедшие секунды: обнулить ячейки буфера, начиная с новой текущей,
+        и пересчитать среднее по остальным window - 1 закрытым секундам.
+        """
+        gap = now - chat.second
+        for second in range(chat.second + 1, chat.second + 1 + min(gap, self.window)):
+            chat.counts[second % self.window] = 0
+        chat.second = now
+        chat.rate = sum(chat.counts) * 60 / (self.window - 1)
+
+    def hit(self, key) -> bool:
+        """
+        Учесть сообщение. True - началась новая секунда и пора проверить пороги через update().
+        """
+        now = int(time.monotonic())
+        chat = self.chats.get(key)
+        if chat is None:
+            if len(self.chats) >= self.max_chats:
+                self._evict()
+            chat = self.chats[key] = ChatRate(self.window, now)
+            rolled = True
+        else:
+            rolled = now != chat.second
+            if rolled:
+                self._roll(chat, now)
+        chat.counts[now % self.window] += 1
+        return rolled
+
+    def _evict(self):
+        """
+        Удалить самый давно добавленный чат, не находящийся в режиме ограничений.
+        """
+        for key, chat in self.chats.items():
+            if not chat.locked:
+                del self.chats[key]
+                return
+
+    def update(self, key, high: int, low: int) -> str:
+        """
+        Сравнить скорость чата с порогами. Возвращает LOCK, UNLOCK или None.
+        """
+        chat = self.chats[key]
+        chat.high, chat.low = high, low
+        if high is None or low is None:
+            return None
+        if not chat.locked and chat.rate > high:
+            chat.locked = True
+            chat.since = chat.second
+            return LOCK
+        if chat.locked and chat.rate < low and chat.second - chat.since >= self.hold:
+            chat.locked = False
+            return UNLOCK
+        return None
+
+    def expire(self) -> list:
+        """
+        Проверить чаты в режиме ограничений, где сообщений больше нет.
+        Возвращает ключи чатов, которые из него вышли.
+        """
+        now = int(time.monotonic())
+        unlocked = []
+        for key, chat in self.chats.items():
+            if chat.locked:
+                if now != chat.second:
+                    self._roll(chat, now)
+                if self.update(key, chat.high, chat.low) == UNLOCK:
+                    unlocked.append(key)
+        return unlocked
+
+    def locked(self, key) -> bool:
+        chat = self.chats.get(key)
+        return chat is not None and chat.locked
+
+    def rate(self, key) -> tuple:
+        """
+        Средняя скорость (сообщений в минуту) и число сообщений за последние window секунд.
+        """
+        chat = self.chats.get(key)
+        if chat is None:
+            return 0.0, 0
+        return chat.rate, sum(chat.counts)
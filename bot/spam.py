@@ -0,0 +1,127 @@
+import random
+import re
+import time
+
+# Количество минхешей в подписи сообщения: BANDS полос по ROWS значений
+BANDS = 6
+ROWS = 3
+# Доля совпадающих минхешей, начиная с которой сообщения считаются почти одинаковыми
+SIMILARITY = 0.7
+# Сообщения короче этого количества слов не проверяются
+MIN_WORDS = 5
+# Максимальное количество записей в одной полосе, старые записи вытесняются
+BUCKET_SIZE = 8
+
+_MASK = (1 << 64) - 1
+_SALTS = tuple(random.getrandbits(64) for _ in range(BANDS * ROWS))
+_WORD = re.compile(r'\w+')
+
+
+def fingerprint(text: str):
+    """
+    Вычислить MinHash-подпись текста по парам соседних слов.
+    Возвращает None, если текст слишком короткий для проверки.
+    """
+    words = _WORD.findall(text.lower())
+    if len(words) < MIN_WORDS:
+        return None
+    hashes = {hash(shingle) & _MASK for shingle in zip(words, words[1:])}
+    return tuple(min(h ^ salt for h in hashes) for salt in _SALTS)
+
+
+class SpamIndex:
+    """
+    Индекс отпечатков последних сообщений из всех чатов.
+    Хранит не больше size записей в кольцевом буфере, поэтому расход памяти фиксирован.
+    Поиск похожих сообщений выполняется через LSH по полосам подписи.
+    Удаленные копии отмечаются обработанными: они по-прежнему учитываются при подсчете
+    чатов, но не возвращаются повторно.
+    """
+
+    def __init__(self, size: int = 4096, window: int = 600, max_chats: int = 3):
+        self.size = size
+        self.window = window
+        self.max_chats = max_chats
+        self._slots = [None] * size
+        self._bands = {}
+        self._pos = 0
+        # Скользящее среднее времени проверки одного сообщения в микросекундах
+        self.avg_cost = 0.0
+
+    @staticmethod
+    def _band_keys(signature: tuple):
+        return [(i, signature[i * ROWS:(i + 1) * ROWS]) for i in range(BANDS)]
+
+    def _evict(self, pos: int):
+        old = self._slots[pos]
+        if old is None:
+            return
+        for key in old[4]:
+            bucket = self._bands.get(key)
+            if bucket is not None:
+                bucket.pop(pos, None)
+                if not bucket:
+                    del self._bands[key]
+
+    def _add(self, owner, chat_id: int, message_id: int, now: float, signature: tuple, keys: list) -> int:
+        pos = self._pos
+        self._evict(pos)
+        self._slots[pos] = (owner, chat_id, message_id, now, keys, signature, False)
+        for key in keys:
+            bucket = self._bands.setdefault(key, {})
+            if len(bucket) >= BUCKET_SIZE:
+                # Вытеснить самую старую запись полосы
+                del bucket[next(iter(bucket))]
+            bucket[pos] = None
+        self._pos = (pos + 1) % self.size
+        return pos
+
+    def check(self, owner, chat_id: int, message_id: int, text: str) -> list:
+        """
+        Добавить сообщение в индекс и найти его почти-дубликаты за последние window секунд.
+        owner - кто получил сообщение (бот, которым его можно удалить).
+        Если дубликаты встречались больше чем в max_chats чатах - вернуть список
+        (pos, owner, chat_id, message_id) еще не обработанных копий вместе с самим
+        сообщением (первым), иначе пустой список.
+        """
+        start = time.perf_counter()
+        signature = fingerprint(text)
+        if signature is None:
+            return []
+        now = time.time()
+        keys = self._band_keys(signature)
+
+        candidates = set()
+        for key in keys:
+            candidates.update(self._bands.get(key, ()))
+
+        copies = []
+        chats = {chat_id}
+        for pos in candidates:
+            other_owner, other_chat, other_message, seen, _, other_signature, handled = self._slots[pos]
+            if now - seen > self.window:
+                continue
+            same = sum(a == b for a, b in zip(signature, other_signature))
+            if same >= SIMILARITY * len(signature):
+                chats.add(other_chat)
+                if not handled:
+                    copies.append((pos, other_owner, other_chat, other_message))
+
+        pos = self._add(owner, chat_id, message_id, now, signature, keys)
+        self.avg_cost += ((time.perf_counter() - start) * 1e6 - self.avg_cost) * 0.01
+        if len(chats) > self.max_chats:
+            return [(pos, owner, chat_id, message_id)] + copies
+        return []
+
+    def handled(self, copies: list):
+        """
+        Отметить копии, которые вернул check, обработанными (удаленными).
+        Записи, вытесненные за это время новыми сообщениями, пропускаются.
+        """
+        for pos, _, chat_id, message_id in copies:
+            slot = self._slots[pos]
+            if slot is not None and slot[1:3] == (chat_id, message_id):
+                self._slots[pos] = slot[:-1] + (True,)
+
+    def __len__(self):
+        return sum(slot is not None for slot in self._slots)
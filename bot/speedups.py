@@ -0,0 +1,62 @@
+"""
+Необязательные ускорения: event loop uvloop и быстрые JSON-библиотеки.
+Если библиотека не установлена, используется стандартная реализация.
+"""
+import asyncio
+import importlib
+import logging
+
+from aiogram.utils import json as aiogram_json
+
+log = logging.getLogger('aiogram')
+
+
+def install_event_loop(fast: bool) -> str:
+    """
+    Установить политику event loop uvloop, если она разрешена и доступна.
+    Должна вызываться до создания event loop.
+    """
+    if fast:
+        try:
+            import uvloop
+        except ImportError:
+            log.warning('uvloop не установлен, используется asyncio')
+        else:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return 'uvloop'
+    return 'asyncio'
+
+
+def _codec(name: str):
+    module = importlib.import_module(name)
+    if name == 'orjson':
+        # orjson возвращает bytes, а aiogram ожидает str
+        return module.loads, lambda obj: module.dumps(obj).decode()
+    return module.loads, module.dumps
+
+
+def _aiogram_codec() -> str:
+    """
+    Кодек, который aiogram выбрал сам: в aiogram 1.x - ujson, если он установлен, иначе json.
+    """
+    if hasattr(aiogram_json, 'mode'):
+        return aiogram_json.mode
+    return 'ujson' if getattr(aiogram_json, '_use_ujson', False) else 'json'
+
+
+def install_json(backend: str = None) -> str:
+    """
+    Заменить JSON-кодек aiogram для входящих обновлений и исходящих запросов.
+    backend: 'orjson', 'ujson', 'json' или 'auto' (самый быстрый из установленных),
+    None - оставить выбор aiogram.
+    """
+    if backend is None:
+        return _aiogram_codec()
+    for name in ('orjson', 'ujson', 'json') if backend == 'auto' else (backend,):
+        try:
+            aiogram_json.loads, aiogram_json.dumps = _codec(name)
+        except ImportError:
+            log.warning(f'{name} не установлен')
+            continue
+        return name
+    return _aiogram_codec()
@@ -0,0 +1,222 @@
+import asyncio
+import datetime
+import json
+import logging
+import math
+
+import asyncpg
+
+log = logging.getLogger('aiogram')
+
+_MASK = (1 << 64) - 1
+# Ключ advisory-блокировки: записи статистики из разных процессов объединяются по очереди
+_FLUSH_LOCK = 0x5354415453
+
+
+def _mix(value: int) -> int:
+    """
+    64-битный хеш splitmix64. В отличие от hash() не зависит от процесса,
+    поэтому сохраненные в БД скетчи можно объединять после перезапуска.
+    """
+    value = (value + 0x9E3779B97F4A7C15) & _MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK
+    return value ^ (value >> 31)
+
+
+class HyperLogLog:
+    """
+    Приблизительный подсчет уникальных пользователей в 2^p байтах.
+    """
+
+    def __init__(self, p: int = 10, registers: bytes = None):
+        self.p = p
+        self.registers = bytearray(registers) if registers else bytearray(1 << p)
+
+    def add(self, value: int):
+        h = _mix(value)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = 64 - self.p - rest.bit_length() + 1
+        index = h >> (64 - self.p)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def __len__(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class TopK:
+    """
+    Самые активные пользователи по алгоритму Space-Saving: не больше size счетчиков.
+    """
+
+    def __init__(self, size: int = 20, counters: dict = None):
+        self.size = size
+        # user_id -> [количество сообщений, имя]
+        self.counters = {} if counters is None else counters
+
+    def add(self, user_id: int, name: str, count: int = 1):
+        counter = self.counters.get(user_id)
+        if counter is not None:
+            counter[0] += count
+            counter[1] = name
+        elif len(self.counters) < self.size:
+            self.counters[user_id] = [count, name]
+        else:
+            # Вытеснить минимальный счетчик, новый наследует его значение
+            smallest = min(self.counters, key=lambda key: self.counters[key][0])
+            self.counters[user_id] = [self.counters.pop(smallest)[0] + count, name]
+
+    def merge(self, other: 'TopK'):
+        for user_id, (count, name) in other.counters.items():
+            self.add(user_id, name, count)
+
+    def top(self, n: int) -> list:
+        return sorted(self.counters.values(), key=lambda counter: -counter[0])[:n]
+
+
+class Bucket:
+    """
+    Статистика одного чата за один час.
+    """
+    __slots__ = ('messages', 'warns', 'bans', 'users', 'posters')
+
+    def __init__(self, messages=0, warns=0, bans=0, users=None, posters=None):
+        self.messages = messages
+        self.warns = warns
+        self.bans = bans
+        self.users = HyperLogLog() if users is None else users
+        self.posters = TopK() if posters is None else posters
+
+    def merge(self, other: 'Bucket'):
+        self.messages += other.messages
+        self.warns += other.warns
+        self.bans += other.bans
+        self.users.merge(other.users)
+        self.posters.merge(other.posters)
+
+
+def _hour(moment: datetime.datetime) -> datetime.datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _from_row(row) -> Bucket:
+    return Bucket(row['messages'], row['warns'], row['bans'], HyperLogLog(registers=row['users']),
+                  TopK(counters={int(k): v for k, v in json.loads(row['posters']).items()}))
+
+
+class ChatStats:
+    """
+    Счетчики активности чатов в памяти, по часовым корзинам.
+    Периодически сбрасываются в таблицу chat_stats: корзина объединяется с уже
+    записанной строкой того же часа, поэтому на чат приходится одна строка в час.
+    Строки старше retention часов удаляются.
+    """
+
+    def __init__(self, pool: asyncpg.pool.Pool, interval: float = 300, retention: int = 7 * 24):
+        self.pool = pool
+        self.interval = interval
+        self.retention = retention
+        self.buckets = {}
+        self._stopped = asyncio.Event()
+
+    def _bucket(self, chat_id: int) -> Bucket:
+        key = chat_id, _hour(datetime.datetime.now(datetime.timezone.utc))
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket()
+        return bucket
+
+    def message(self, chat_id: int, user_id: int, name: str):
+        """
+        Учесть сообщение пользователя. Не обращается к БД.
+        """
+        bucket = self._bucket(chat_id)
+        bucket.messages += 1
+        bucket.users.add(user_id)
+        bucket.posters.add(user_id, name)
+
+    def warn(self, chat_id: int):
+        self._bucket(chat_id).warns += 1
+
+    def ban(self, chat_id: int):
+        self._bucket(chat_id).bans += 1
+
+    def __len__(self):
+        return len(self.buckets)
+
+    async def flush(self):
+        """
+        Записать накопленные корзины в БД и начать новые.
+        Записанные ранее строки тех же часов удаляются и объединяются с корзинами в памяти.
+        """
+        buckets, self.buckets = self.buckets, {}
+        if not buckets:
+            return
+        chat_ids, hours = zip(*buckets)
+        oldest = _hour(datetime.datetime.now(datetime.timezone.utc)) - datetime.timedelta(hours=self.retention)
+        try:
+            async with self.pool.acquire() as con:
+                async with con.transaction():
+                    await con.execute('SELECT pg_advisory_xact_lock($1)', _FLUSH_LOCK)
+                    rows = await con.fetch('DELETE FROM chat_stats s '
+                                           'USING unnest($1::bigint[], $2::timestamptz[]) AS k (chat_id, hour) '
+                                           'WHERE s.chat_id = k.chat_id AND s.hour = k.hour '
+                                           'RETURNING s.chat_id, s.hour, s.messages, s.warns, s.bans, '
+                                           's.users, s.posters', list(chat_ids), list(hours))
+                    merged = {key: Bucket() for key in buckets}
+                    for row in rows:
+                        merged[row['chat_id'], row['hour']].merge(_from_row(row))
+                    for key, bucket in buckets.items():
+                        merged[key].merge(bucket)
+                    records = [(chat_id, hour, b.messages, b.warns, b.bans, bytes(b.users.registers),
+                                json.dumps(b.posters.counters, ensure_ascii=False))
+                               for (chat_id, hour), b in merged.items()]
+                    await con.copy_records_to_table('chat_stats', records=records,
+                                                    columns=('chat_id', 'hour', 'messages', 'warns',
+                                                             'bans', 'users', 'posters'))
+                    await con.execute('DELETE FROM chat_stats WHERE hour < $1', oldest)
+        except (OSError, asyncpg.PostgresError):
+            log.exception(f'Не удалось записать статистику {len(buckets)} корзин')
+
+    async def run(self):
+        """
+        Фоновая задача: сбрасывать статистику раз в interval секунд.
+        Завершается после stop(), не прерывая начатую запись.
+        """
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), self.interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    def stop(self):
+        """
+        Остановить run(). Оставшиеся корзины записывает flush() после завершения задачи.
+        """
+        self._stopped.set()
+
+    async def query(self, chat_id: int, hours: int = 24) -> dict:
+        """
+        Объединить сохраненные и еще не записанные корзины чата за последние hours часов.
+        Возвращает словарь час -> Bucket и общий Bucket под ключом None.
+        """
+        since = _hour(datetime.datetime.now(datetime.timezone.utc)) - datetime.timedelta(hours=hours - 1)
+        rows = await self.pool.fetch('SELECT hour, messages, warns, bans, users, posters FROM chat_stats '
+                                     'WHERE chat_id=$1 AND hour >= $2', chat_id, since)
+        result = {None: Bucket()}
+        parts = [(row['hour'], _from_row(row)) for row in rows]
+        parts += [(hour, bucket) for (chat, hour), bucket in list(self.buckets.items())
+                  if chat == chat_id and hour >= since]
+        for hour, bucket in parts:
+            result.setdefault(hour, Bucket()).merge(bucket)
+            result[None].merge(bucket)
+        return result
@@ -0,0 +1,163 @@
+"""
+Несколько ботов в одном процессе.
+Каждый бот (арендатор) получает свои Bot, Dispatcher и хранилище состояний (в нем же
+счетчики throttle), а подключения к БД, кеши, ограничитель исходящих запросов
+и контроль нагрузки у всех общие.
+"""
+import asyncio
+import collections
+import time
+
+from aiogram import Bot, types
+from aiogram.dispatcher import Dispatcher, ctx
+from aiogram.dispatcher.handler import Handler
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.utils import context, json
+from aiohttp import web
+
+from bot.shedding import LoadShedder, classify
+
+
+class RateLimiter:
+    """
+    Ограничитель исходящих запросов к Bot API (token bucket), общий для всех ботов.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TenantBot(Bot):
+    """
+    Bot, пропускающий каждый запрос к API через общий RateLimiter.
+    """
+
+    def __init__(self, *args, limiter: RateLimiter, metrics: collections.Counter, **kwargs):
+        super(TenantBot, self).__init__(*args, **kwargs)
+        self.limiter = limiter
+        self.metrics = metrics
+
+    async def request(self, *args, **kwargs):
+        self.metrics['api_requests'] += 1
+        await self.limiter.acquire()
+        return await super(TenantBot, self).request(*args, **kwargs)
+
+
+class TenantDispatcher(Dispatcher):
+    """
+    Dispatcher, пропускающий обновления через общий LoadShedder.
+    """
+
+    def __init__(self, *args, name: str, owner: int, shedder: LoadShedder, **kwargs):
+        super(TenantDispatcher, self).__init__(*args, **kwargs)
+        self.name = name
+        self.owner = owner
+        self.shedder = shedder
+
+    async def process_update(self, update):
+        coro = super(TenantDispatcher, self).process_update(update)
+        priority = classify(update, self.shedder.statuses, self.owner)
+        return await self.shedder.run(priority, coro, label=self.name)
+
+
+class Tenant:
+    """
+    Настройки и объекты одного бота.
+    """
+
+    def __init__(self, name: str, token: str, bot_id: int, owner: int, channel: str, path: str,
+                 loop, storage, limiter: RateLimiter, shedder: LoadShedder, **kwargs):
+        self.name = name
+        self.bot_id = bot_id
+        self.owner = owner
+        self.channel = channel
+        self.path = path
+        # Счетчики для метрик, помеченные именем бота (!load, GET /load)
+        self.metrics = collections.Counter()
+        self.bot = TenantBot(token=token, loop=loop, limiter=limiter, metrics=self.metrics, **kwargs)
+        self.dp = TenantDispatcher(self.bot, storage=storage, name=name, owner=owner, shedder=shedder)
+
+
+tenants = []
+_by_path = {}
+_by_dispatcher = {}
+
+
+def create_tenants(configs: list, loop, storage_factory, limiter: RateLimiter, shedder: LoadShedder,
+                   **kwargs) -> list:
+    """
+    Создать ботов по списку настроек BOTS.
+    storage_factory создает хранилище для каждого бота: если два бота в одном чате
+    делили бы одно хранилище, AntiFlood каждого видел бы сообщение дважды.
+    """
+    for config in configs:
+        tenant = Tenant(**config, loop=loop, storage=storage_factory(), limiter=limiter, shedder=shedder, **kwargs)
+        tenants.append(tenant)
+        _by_path[tenant.path] = tenant
+        _by_dispatcher[tenant.dp] = tenant
+    return tenants
+
+
+def share_handlers(source: Dispatcher, target: Dispatcher):
+    """
+    Подключить к target обработчики, зарегистрированные в source.
+    Списки обработчиков общие, а middleware у каждого диспетчера свои.
+    """
+    for name, handler in vars(source).items():
+        # updates_handler содержит process_update самого диспетчера
+        if isinstance(handler, Handler) and name != 'updates_handler':
+            getattr(target, name).handlers = handler.handlers
+
+
+def current_tenant() -> Tenant:
+    """
+    Бот, который обрабатывает текущее обновление.
+    """
+    return _by_dispatcher[ctx.get_dispatcher()]
+
+
+class CurrentBot:
+    """
+    Заменитель Bot для обработчиков: вызовы уходят боту, получившему обновление.
+    """
+
+    def __getattr__(self, item):
+        return getattr(current_tenant().bot, item)
+
+
+class TenantWebhookHandler(WebhookRequestHandler):
+    """
+    Обработчик webhook'а, выбирающий диспетчер по пути запроса.
+    """
+
+    def get_dispatcher(self):
+        dp = _by_path[self.request.path].dp
+        # Как в WebhookRequestHandler.get_dispatcher: ctx.get_dispatcher() и ctx.get_bot() читают контекст
+        context.set_value('dispatcher', dp)
+        context.set_value('bot', dp.bot)
+        return dp
+
+    async def parse_update(self, bot):
+        # Разбор тела запроса выбранным JSON-кодеком (см. bot.speedups)
+        return types.Update(**json.loads(await self.request.text()))
+
+    async def post(self):
+        # Во время остановки Telegram получит ошибку и повторит доставку новому процессу
+        tenant = _by_path[self.request.path]
+        if not tenant.dp.shedder.accepting:
+            raise web.HTTPServiceUnavailable()
+        # get_dispatcher вызывается за запрос дважды, поэтому обновление считается здесь
+        tenant.metrics['updates'] += 1
+        return await super(TenantWebhookHandler, self).post()
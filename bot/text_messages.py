@@ -59,6 +59,69 @@ text_messages = {
             'Отправьте сообщение, которое будет отправлятся каждому новому пользователю. Используйте {name}, '
             'что бы вставить имя пользователя, а так же разметку MARKDOWN для разметки сообщения.'
     ),
+    'wrong_audit_syntax': (
+            wrong_syntax +
+            '!audit номер_страницы. Ответьте командой на сообщение, чтобы показать действия с его автором.'
+    ),
+    'audit_empty': (
+            'В журнале нет записей.'
+    ),
+    'wrong_stats_syntax': (
+            wrong_syntax +
+            '!stats количество_часов (от 1 до 168).'
+    ),
+    'load_status': (
+            'В обработке: {0}, в очереди: {1}, задержка loop: {2:.3f} с.\n'
+            'Отброшено:\n{3}\n'
+            'Обновлений / запросов к API по ботам:\n{4}'
+    ),
+    'wrong_template_syntax': (
+            wrong_syntax +
+            '!template_save имя - сохранить настройки этого чата как шаблон; '
+            '!template_apply имя [all | id_чата ...] - применить шаблон к этому, всем или перечисленным чатам.'
+    ),
+    'template_saved': (
+            'Шаблон {0} сохранен.'
+    ),
+    'template_applied': (
+            'Шаблон {0} применен к чатам: {1}.'
+    ),
+    'wrong_export_syntax': (
+            wrong_syntax +
+            '!export csv или !export jsonl'
+    ),
+    'global_only': (
+            'Изменять настройки других чатов могут только глобальные администраторы (GLOBAL_ADMINS).'
+    ),
+    'get_settings_import': (
+            'Отправьте файл settings.csv или settings.jsonl в формате !export. Или cancel для отмены.'
+    ),
+    'settings_imported': (
+            'Импортированы настройки чатов: {0}.'
+    ),
+    'settings_import_error': (
+            'Ошибка при чтении или записи файла настроек.'
+    ),
+    'slow_mode_on': (
+            'В чате слишком много сообщений ({0} в минуту). Включен режим ограничений: '
+            'ограничение частоты сообщений ужесточено, новые участники не могут писать.'
+    ),
+    'slow_mode_off': (
+            'Режим ограничений выключен.'
+    ),
+    'wrong_slow_rate': (
+            'Порог выключения должен быть больше нуля и меньше порога включения.'
+    ),
+    'restrictions_empty': (
+            'В чате нет действующих ограничений.'
+    ),
+    'wrong_lift_syntax': (
+            wrong_syntax +
+            '!lift id_пользователя [id_пользователя ...] или !lift all - снять все ограничения в чате.'
+    ),
+    'lifted': (
+            'Сняты ограничения с пользователей: {0}.'
+    ),
     'get_time_ban': (
             'Отправьте время блокировки пользователя после получения максимума предупреждений в минутах.'
     )
@@ -1,29 +1,47 @@
 import asyncio
+import csv
 import functools
+import io
 import logging
 import math
 import time
 import random
-import re
+import socket
 import ssl
 
 import asyncpg
 from aiohttp import web
 
-from aiogram import Bot, types
+from aiogram import types
+from aiogram.bot import api
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.dispatcher import Dispatcher, CancelHandler, ctx
+from aiogram.dispatcher import CancelHandler, ctx
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from aiogram.dispatcher.webhook import get_new_configured_app
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY
 from aiogram.utils import context
-from aiogram.utils.exceptions import Throttled, MessageTextIsEmpty, BadRequest, MessageCantBeDeleted
+from aiogram.utils.exceptions import Throttled, MessageTextIsEmpty, BadRequest, MessageCantBeDeleted, TelegramAPIError
 from aiogram.utils.markdown import italic
 from aiogram.types import ParseMode, InlineKeyboardMarkup, InlineKeyboardButton, ContentType
 
 from bot import calculate_time, rate_limit
-from bot.call_later import call_later
+from bot.admin_api import setup_routes
+from bot.audit import AuditLog
+from bot.call_later import call_later, pending
 from bot.config import *
-from bot.db import create_conn, gen_prepared_query
+from bot.db import ReadRouter, create_conn, create_pool, ensure_schema, gen_prepared_query
+from bot.jobs import restore_jobs, restore_jobs_during_handoff, save_jobs
+from bot.memory import MemoryBudget, evict_storage, rss, trace
+from bot.settings_io import FORMATS, apply_template, export_settings, import_settings, parse_settings, save_template
+from bot.normalize import evict_forbidden, find_forbidden, forbidden_cache, forbidden_words
+from bot.polling import Poller
+from bot.restrictions import BAN, MUTE, Restrictions
+from bot.shedding import LoadShedder
+from bot.slowmode import LOCK, SlowMode
+from bot.spam import SpamIndex
+from bot.speedups import install_event_loop, install_json
+from bot.stats import ChatStats
+from bot.tenants import (CurrentBot, RateLimiter, TenantWebhookHandler, create_tenants, current_tenant,
+                         share_handlers)
 from bot.text_messages import text_messages, random_mess
 
 log = logging.getLogger('aiogram')
@@ -31,18 +49,78 @@ logging.basicConfig(level=logging.INFO)
 
 admins = 'creator', 'administrator'
 
+loop_backend = install_event_loop(FAST_LOOP)
+json_backend = install_json(JSON_BACKEND)
+log.info(f'Event loop: {loop_backend}, JSON: {json_backend}')
+
 loop = asyncio.get_event_loop()
+# Фабрика задач переносит контекст aiogram (ctx.get_dispatcher) в дочерние задачи
 loop.set_task_factory(context.task_factory)
 
-storage = MemoryStorage()
-bot = Bot(token=TOKEN, loop=loop, parse_mode=ParseMode.MARKDOWN)
+shedder = LoadShedder(SHED_MAX_IN_FLIGHT, SHED_MAX_LAG, command_slots=SHED_COMMAND_SLOTS, status_ttl=MEMBER_STATUS_TTL)
+# У каждого бота свое хранилище состояний и счетчиков throttle
+tenants = create_tenants(BOTS, loop, MemoryStorage, RateLimiter(OUTBOUND_RATE), shedder,
+                         parse_mode=ParseMode.MARKDOWN)
 
-dp = Dispatcher(bot, storage=storage)
+# Обработчики регистрируются в диспетчере первого бота и подключаются к остальным
+dp = tenants[0].dp
+# Бот, получивший текущее обновление
+bot = CurrentBot()
 
 conn = loop.run_until_complete(create_conn(**DB))  # Подключаемся к БД
+loop.run_until_complete(ensure_schema(conn))  # Добавляем таблицы и столбцы новых версий
 prepared_query = loop.run_until_complete(gen_prepared_query(conn))  # Получаем подготовленые выражения
-
-WEBHOOK_URL = f"https://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_URL_PATH}"
+pool = loop.run_until_complete(create_pool(**DB))  # Пул соединений для фоновых задач
+# Чтения настроек выполняются на репликах, если они указаны
+replicas = [loop.run_until_complete(create_pool(**replica)) for replica in DB_REPLICAS]
+reads = ReadRouter(pool, replicas, REPLICA_MAX_LAG, REPLICA_CHECK_INTERVAL, SETTINGS_CACHE_TTL, REPLICA_TIMEOUT)
+
+audit = AuditLog(pool, AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL, AUDIT_QUEUE_SIZE)
+restrictions = Restrictions(pool, RESTRICTIONS_RECONCILE_INTERVAL)
+stats = ChatStats(pool, STATS_FLUSH_INTERVAL, STATS_RETENTION)
+
+spam_index = SpamIndex(SPAM_INDEX_SIZE, SPAM_WINDOW, SPAM_MAX_CHATS)
+slow_mode = SlowMode(SLOW_MODE_WINDOW, SLOW_MODE_HOLD, SLOW_MODE_MAX_CHATS)
+
+memory = MemoryBudget(MEMORY_BUDGET, MEMORY_CHECK_INTERVAL)
+memory.track('settings', lambda: reads.cache, reads.evict, CACHE_BUDGETS.get('settings'))
+memory.track('forbidden_words', lambda: forbidden_cache, evict_forbidden, CACHE_BUDGETS.get('forbidden_words'))
+for tenant in tenants:
+    memory.track(f'storage_{tenant.name}', lambda storage=tenant.dp.storage: storage.data,
+                 functools.partial(evict_storage, tenant.dp.storage), CACHE_BUDGETS.get('storage'))
+memory.track('stats', lambda: stats.buckets, lambda fraction: stats.flush(), CACHE_BUDGETS.get('stats'))
+memory.track('pending_jobs', lambda: pending)
+memory.track('slow_mode', lambda: slow_mode.chats)
+memory.track('member_statuses', lambda: shedder.statuses.entries)
+
+
+def memory_report(trace_action: str = None) -> dict:
+    """
+    Сведения о памяти: кеши, очереди, задачи, RSS и (по запросу) топ tracemalloc.
+    """
+    return {'rss': rss(),
+            'budget': memory.budget,
+            'caches': memory.report(),
+            'evictions': memory.evictions,
+            'spam_index': {'entries': len(spam_index), 'size': spam_index.size,
+                           'avg_cost_us': round(spam_index.avg_cost, 1)},
+            'audit_queue': len(audit),
+            'tasks': len(asyncio.all_tasks(loop)),
+            'tracemalloc': trace(None if trace_action == 'top' else trace_action)}
+
+
+async def member_status(chat_id: int, user_id: int) -> str:
+    """
+    Статус участника чата. Ответ get_chat_member запоминается на MEMBER_STATUS_TTL секунд,
+    по нему же команды известных администраторов получают приоритет при нагрузке.
+    Из кеша берется только отсутствие прав: права администратора проверяются заново,
+    чтобы снятый администратор сразу терял доступ к командам.
+    """
+    status = shedder.statuses.get(chat_id, user_id)
+    if status is None or status in admins:
+        status = (await bot.get_chat_member(chat_id, user_id)).status
+        shedder.statuses.set(chat_id, user_id, status)
+    return status
 
 
 def set_privileges(privilege):
@@ -55,26 +133,46 @@ def set_privileges(privilege):
         @functools.wraps(func)
         async def wrapper(message: types.Message):
             if privilege == 'administrator':  # Привелигия админ
-                response = await bot.get_chat_member(message.chat.id, message.from_user.id)
-                if response.status in admins:
+                status = await member_status(message.chat.id, message.from_user.id)
+                if status in admins:
                     await func(message)
             elif privilege == 'creator':  # Привелигия создатель
-                response = await bot.get_chat_member(message.chat.id, message.from_user.id)
-                if response.status == 'creator':
+                status = await member_status(message.chat.id, message.from_user.id)
+                if status == 'creator':
+                    await func(message)
+            elif privilege == 'owner':  # Доступно только создателю бота
+                if message.from_user.id == current_tenant().owner:
+                    await func(message)
+            elif privilege == 'global':  # Действия со всеми чатами всех ботов
+                if message.from_user.id in GLOBAL_ADMINS:
                     await func(message)
-            elif privilege == MY_ID:  # Доступно только создателю бота
-                await func(message)
 
         return wrapper
 
     return decorator
 
 
+async def send_error(message: types.Message, text: str, delay: int):
+    """
+    Отправить сообщение об ошибке и удалить его через delay секунд.
+    При перегрузке сообщение не отправляется.
+    """
+    if not shedder.allow('error_reply', current_tenant().name):
+        return
+    sent_m = await bot.send_message(message.chat.id, text)
+    call_later(delay, bot.delete_message, sent_m.chat.id, sent_m.message_id, loop=loop)
+
+
 async def warn_do(message: types.Message, warn: dict):
     """
     Обработать предупреждения для пользователя.
     """
     parametres = warn['chat_id'], warn['user_id']
+    # Автоматическое предупреждение выдает бот, иначе - автор команды
+    actor_id = current_tenant().bot_id if message.from_user.id == warn['user_id'] else message.from_user.id
+    audit.log('warn', warn['chat_id'], actor_id, warn['user_id'])
+    stats.warn(warn['chat_id'])
+    # Чтение перед записью - только с основной базы
     res = await prepared_query['warn_select'].fetch(*parametres)
     # Записи нет в базе данных - создать
     if not res:
@@ -86,10 +184,10 @@ async def warn_do(message: types.Message, warn: dict):
         # Количество прошлых предупреждений увеличить на 1
         await prepared_query['warn_update'].fetch(*parametres)
         # Настройки предупреждений для чата
-        warn_settings = (await prepared_query['get_warn_settings'].fetch(warn['chat_id']))[0]
+        warn_settings = (await reads.fetch('get_warn_settings', warn['chat_id']))[0]
         max_warn = warn_settings['max_warn']
         time_ban = warn_settings['time_ban']
-        # Получить новое количество предупреждений пользователя
+        # Получить новое количество предупреждений пользователя (с основной базы, после записи)
         warn_count = (await prepared_query['get_warn_count'].fetch(*parametres))[0]['warn_count']
         await bot.send_message(message.chat.id,
                                text_messages['warn_notif'].format(warn['name'], warn['user_id'], warn_count))
@@ -102,6 +200,8 @@ async def warn_do(message: types.Message, warn: dict):
                                            can_send_media_messages=False,
                                            can_send_other_messages=False,
                                            can_add_web_page_previews=False)
+            audit.log('warn_mute', warn['chat_id'], current_tenant().bot_id, warn['user_id'], f'{time_ban} мин.')
+            await restrictions.add(warn['chat_id'], warn['user_id'], MUTE, until, f'{warn_count} warn')
             await bot.send_message(message.chat.id,
                                    text_messages['max_warning'].format(warn['name'], warn['user_id'], time_ban))
             # Очистить предупреждения для пользователя
@@ -127,15 +227,18 @@ class CallbackAntiFlood(BaseMiddleware):
                 try:
                     await dispatcher.throttle('settings_callback', rate=0.5)
                 except Throttled as throttled:
-                    response = await bot.get_chat_member(call.message.chat.id, call.from_user.id)
-                    if response.status not in admins:
+                    status = await member_status(call.message.chat.id, call.from_user.id)
+                    if status not in admins:
                         
                         # Заблокировать
                         if throttled.exceeded_count <= 2:
                             name = call.from_user.full_name
                             user_id = call.from_user.id
-                            await bot.kick_chat_member(call.message.chat.id, user_id,
-                                                       until_date=math.floor(time.time()) + 10 * 60)
+                            until = math.floor(time.time()) + 10 * 60
+                            await bot.kick_chat_member(call.message.chat.id, user_id, until_date=until)
+                            audit.log('callback_flood_ban', call.message.chat.id, current_tenant().bot_id, user_id, '10 мин.')
+                            await restrictions.add(call.message.chat.id, user_id, BAN, until, 'callback_flood')
+                            stats.ban(call.message.chat.id)
                             await bot.send_message(call.message.chat.id,
                                                    f'[{name}](tg://user?id={user_id}) заблокирован '
                                                    'на 10 минут за бездумное нажатие по кнопкам :).')
@@ -152,31 +255,114 @@ class WordsFilter(BaseMiddleware):
         И обробатывает их в зависимости от настроек чата.
         """
         if message.text is not None:
-            async with asyncpg.create_pool(**DB,
-                                           command_timeout=60) as pool:
-                async with pool.acquire() as con:
-                    try:
-                        res = (await con.fetch('SELECT mat_list, auto_warn FROM settings WHERE chat_id=$1', message.chat.id))[0]
-                        auto_warn = res['auto_warn']
-                        if auto_warn:
-                            mat_list = res['mat_list']
-                            forbidden_words = frozenset(mat_list.split(','))
-                            # Разобрать текст пользователя на слова
-                            user_words = frozenset(re.findall(r'\w+', message.text.lower()))
-                            # Поиск совпадений
-                            mes = forbidden_words & user_words
-                            if mes:
-                                await bot.delete_message(message.chat.id, message.message_id)
-                                warn_list = {'chat_id': message.chat.id,
-                                             'user_id': message.from_user.id,
-                                             'name': message.from_user.full_name}
-                                response = await bot.get_chat_member(message.chat.id, message.from_user.id)
-                                if response.status in admins:
-                                    await bot.send_message(message.chat.id, text_messages['warn_admin'])
-                                else:
-                                    await warn_do(message, warn_list)
-                    except (AttributeError, IndexError):
-                        return
+            try:
+                res = (await reads.fetch('filter_settings', message.chat.id))[0]
+                auto_warn = res['auto_warn']
+                if auto_warn:
+                    # Нормализованные запрещенные слова чата (кешируются по mat_list)
+                    forbidden = forbidden_words(res['mat_list'])
+                    # Поиск совпадений в нормализованном тексте пользователя
+                    mes = find_forbidden(message.text, forbidden)
+                    if mes:
+                        await bot.delete_message(message.chat.id, message.message_id)
+                        warn_list = {'chat_id': message.chat.id,
+                                     'user_id': message.from_user.id,
+                                     'name': message.from_user.full_name}
+                        status = await member_status(message.chat.id, message.from_user.id)
+                        if status in admins:
+                            await bot.send_message(message.chat.id, text_messages['warn_admin'])
+                        else:
+                            await warn_do(message, warn_list)
+                        # Сообщение удалено, остальные фильтры и обработчики не нужны
+                        raise CancelHandler()
+            except (AttributeError, IndexError):
+                return
+
+
+class SpamFilter(BaseMiddleware):
+
+    @staticmethod
+    async def on_pre_process_message(message: types.Message):
+        """
+        Ищет почти одинаковые сообщения, разосланные в несколько чатов.
+        Удаляет все найденные копии и выдает предупреждение отправителю.
+        """
+        if message.text is None:
+            return
+        copies = spam_index.check(current_tenant(), message.chat.id, message.message_id, message.text)
+        if not copies:
+            return
+        status = await member_status(message.chat.id, message.from_user.id)
+        if status in admins:
+            return
+        # Копию удаляет бот, получивший ее: чат может обслуживать другой бот
+        for _, tenant, chat_id, message_id in copies:
+            try:
+                await tenant.bot.delete_message(chat_id, message_id)
+            except TelegramAPIError:
+                continue
+        # Удаленные копии не удаляются повторно при следующих рассылках
+        spam_index.handled(copies)
+        audit.log('spam', message.chat.id, current_tenant().bot_id, message.from_user.id,
+                  f'копий: {len(copies) - 1}')
+        warn_list = {'chat_id': message.chat.id,
+                     'user_id': message.from_user.id,
+                     'name': message.from_user.full_name}
+        await warn_do(message, warn_list)
+        # Второе предупреждение за то же сообщение от WordsFilter не нужно
+        raise CancelHandler()
+
+
+class StatsCounter(BaseMiddleware):
+
+    @staticmethod
+    async def on_pre_process_message(message: types.Message):
+        """
+        Учитывает сообщение в статистике чата. Счетчики хранятся в памяти.
+        """
+        if message.from_user is not None:
+            stats.message(message.chat.id, message.from_user.id, message.from_user.full_name)
+
+
+class SlowModeGuard(BaseMiddleware):
+
+    @staticmethod
+    async def on_pre_process_message(message: types.Message):
+        """
+        Учитывает сообщение в скорости чата и раз в секунду сверяет ее с порогами из настроек.
+        """
+        key = current_tenant().name, message.chat.id
+        if not slow_mode.hit(key):
+            return
+        try:
+            res = (await reads.fetch('slow_settings', message.chat.id))[0]
+        except IndexError:
+            return
+        change = slow_mode.update(key, res['slow_rate_high'], res['slow_rate_low'])
+        if change == LOCK:
+            rate = round(slow_mode.rate(key)[0])
+            audit.log('slow_mode_on', message.chat.id, current_tenant().bot_id, None, f'{rate} в мин.')
+            await bot.send_message(message.chat.id, text_messages['slow_mode_on'].format(rate))
+        elif change is not None:
+            audit.log('slow_mode_off', message.chat.id, current_tenant().bot_id)
+            await bot.send_message(message.chat.id, text_messages['slow_mode_off'])
+
+
+async def slow_mode_monitor():
+    """
+    Фоновая задача: выключает режим ограничений в чатах, где флуд прекратился.
+    """
+    by_name = {tenant.name: tenant for tenant in tenants}
+    while True:
+        await asyncio.sleep(1)
+        for name, chat_id in slow_mode.expire():
+            tenant = by_name[name]
+            audit.log('slow_mode_off', chat_id, tenant.bot_id)
+            # Бота могли удалить из чата или ограничить: задача не должна завершаться
+            try:
+                await tenant.bot.send_message(chat_id, text_messages['slow_mode_off'])
+            except TelegramAPIError:
+                continue
 
 
 class AntiFlood(BaseMiddleware):
@@ -204,12 +390,16 @@ class AntiFlood(BaseMiddleware):
             limit = self.rate_limit
             key = f"{self.prefix}_message"
 
+        # В режиме ограничений чата интервал между сообщениями увеличивается
+        if slow_mode.locked((current_tenant().name, message.chat.id)):
+            limit *= SLOW_MODE_FACTOR
+
         # Использовать Dispatcher.throttle метод
         try:
             await dispatcher.throttle(key, rate=limit)
         except Throttled as t:
-            response = await bot.get_chat_member(message.chat.id, message.from_user.id)
-            if response.status not in admins:
+            status = await member_status(message.chat.id, message.from_user.id)
+            if status not in admins:
                 # Выполнять действия
                 await self.message_throttled(message, t)
 
@@ -229,12 +419,15 @@ class AntiFlood(BaseMiddleware):
                 await bot.delete_message(message.chat.id, message.message_id)
             except MessageCantBeDeleted:
                 return
+            until = math.floor(time.time()) + 10 * 60
             await bot.restrict_chat_member(message.chat.id, user_id,
-                                           until_date=math.floor(time.time()) + 10 * 60,
+                                           until_date=until,
                                            can_send_messages=False,
                                            can_send_media_messages=False,
                                            can_send_other_messages=False,
                                            can_add_web_page_previews=False)
+            audit.log('flood_mute', message.chat.id, current_tenant().bot_id, user_id, '10 мин.')
+            await restrictions.add(message.chat.id, user_id, MUTE, until, 'flood')
             await bot.send_message(message.chat.id,
                                    f'[{name}](tg://user?id={user_id}) заблокирован'
                                    ' на 10 минут за попытку зафлудить меня.')
@@ -253,17 +446,34 @@ async def welcome(message: types.Message):
         await bot.kick_chat_member(message.chat.id, message.new_chat_members[0].id)
         await message.delete()
         return
-    res = (await prepared_query['welcome_select'].fetch(message.chat.id))
+    # В режиме ограничений вступившие не могут писать, приветствие не показывается
+    if slow_mode.locked((current_tenant().name, message.chat.id)):
+        for member in message.new_chat_members:
+            if member.id != current_tenant().bot_id:
+                until = math.floor(time.time()) + SLOW_MODE_NEW_MEMBER_MUTE
+                await bot.restrict_chat_member(message.chat.id, member.id,
+                                               until_date=until,
+                                               can_send_messages=False,
+                                               can_send_media_messages=False,
+                                               can_send_other_messages=False,
+                                               can_add_web_page_previews=False)
+                audit.log('slow_mode_mute', message.chat.id, current_tenant().bot_id, member.id,
+                          f'{SLOW_MODE_NEW_MEMBER_MUTE // 60} мин.')
+                await restrictions.add(message.chat.id, member.id, MUTE, until, 'slow_mode')
+        if current_tenant().bot_id not in [member.id for member in message.new_chat_members]:
+            return
+    res = await reads.fetch('welcome_select', message.chat.id)
     # Бота добавили в чат
-    if message.new_chat_members[0].id == BOT_ID:
+    if message.new_chat_members[0].id == current_tenant().bot_id:
         await bot.send_message(message.chat.id, text_messages['admin_required'])
         # Создаем запись для настроек чата в БД
         try:
             await prepared_query['welcome_insert'].fetch(message.chat.id)
+            reads.invalidate([message.chat.id])
         except asyncpg.exceptions.UniqueViolationError:
             log.info(f'Запись {message.chat.id} уже существует в БД')
     # В чат вступил пользователь, проверяем настройки БД
-    elif message.new_chat_members[0].id != BOT_ID and res:
+    elif res and shedder.allow('welcome', current_tenant().name):
         welcome_mes = res[0]['welcome_mes']
         if welcome_mes is not None:
             user_id = message.new_chat_members[0].id
@@ -285,9 +495,7 @@ async def pin(message: types.Message):
     try:
         await bot.pin_chat_message(message.chat.id, message.reply_to_message.message_id, disable_notification=True)
     except AttributeError:
-        sent_m = await bot.send_message(message.chat.id, text_messages['wrong_pin_syntax'])
-        # Удалить сообщение об ошибке через время
-        call_later(10, bot.delete_message, sent_m.chat.id, sent_m.message_id, loop=loop)
+        await send_error(message, text_messages['wrong_pin_syntax'], 10)
 
 
 @dp.message_handler(func=lambda message: message.text.startswith('!ban'))
@@ -300,7 +508,7 @@ async def ban(message: types.Message):
     try:
         name = message.reply_to_message.from_user.full_name
         user_id = message.reply_to_message.from_user.id
-        if user_id == BOT_ID:  # Попытка забанить бота
+        if user_id == current_tenant().bot_id:  # Попытка забанить бота
             await bot.send_message(message.chat.id, random.choice(random_mess))
             return
         split_message = message.text.split()[1:]
@@ -313,6 +521,10 @@ async def ban(message: types.Message):
             await bot.kick_chat_member(message.chat.id,
                                        message.reply_to_message.from_user.id,
                                        until_date=until)
+            audit.log('ban', message.chat.id, message.from_user.id, user_id,
+                      f'{time_calc[0]} {time_calc[1]} {cause.strip()}')
+            await restrictions.add(message.chat.id, user_id, BAN, until, cause.strip())
+            stats.ban(message.chat.id)
             await bot.send_message(message.chat.id,
                                    f'[{name}](tg://user?id={user_id}) забанен на {str(time_calc[0])} {time_calc[1]}\n'
                                    f'Причина: {italic(cause)}.')
@@ -320,6 +532,9 @@ async def ban(message: types.Message):
         elif not split_message[0][:-1].isdigit():
             cause = message.text[5:]
             await bot.kick_chat_member(message.chat.id, user_id)
+            audit.log('ban', message.chat.id, message.from_user.id, user_id, cause.strip())
+            await restrictions.add(message.chat.id, user_id, BAN, None, cause.strip())
+            stats.ban(message.chat.id)
             await bot.send_message(message.chat.id,
                                    f'[{name}](tg://user?id={user_id}) забанен навсегда.\n'
                                    f'Причина: {italic(cause)}.')
@@ -327,8 +542,7 @@ async def ban(message: types.Message):
         else:
             raise AttributeError
     except (AttributeError, IndexError, ValueError, TypeError):
-        sent_m = await bot.send_message(message.chat.id, text_messages['wrong_ban_syntax'])
-        call_later(15, bot.delete_message, sent_m.chat.id, sent_m.message_id, loop=loop)
+        await send_error(message, text_messages['wrong_ban_syntax'], 15)
 
 
 @dp.message_handler(func=lambda message: message.text.startswith('!mute'))
@@ -340,7 +554,7 @@ async def mute(message: types.Message):
     """
     try:
         user_id = message.reply_to_message.from_user.id
-        if user_id == BOT_ID:
+        if user_id == current_tenant().bot_id:
             await bot.send_message(message.chat.id, random.choice(random_mess))
             return
         time_mute = message.text.split()[1]
@@ -353,12 +567,13 @@ async def mute(message: types.Message):
                                        can_send_media_messages=False,
                                        can_send_other_messages=False,
                                        can_add_web_page_previews=False)
+        audit.log('mute', message.chat.id, message.from_user.id, user_id, f'{time_calc[0]} {time_calc[1]}')
+        await restrictions.add(message.chat.id, user_id, MUTE, until)
         await bot.send_message(message.chat.id,
                                f'[{name}](tg://user?id={user_id}) запрещено отправлять сообщения'
                                f' на {str(time_calc[0])} {time_calc[1]}')
     except (IndexError, ValueError, AttributeError, TypeError):
-        sent_m = await bot.send_message(message.chat.id, text_messages['wrong_mute_syntax'])
-        call_later(15, bot.delete_message, sent_m.chat.id, sent_m.message_id, loop=loop)
+        await send_error(message, text_messages['wrong_mute_syntax'], 15)
 
 
 @dp.message_handler(func=lambda message: message.text.startswith('!unmute'))
@@ -371,7 +586,7 @@ async def unmute(message: types.Message):
     try:
         name = message.reply_to_message.from_user.full_name
         user_id = message.reply_to_message.from_user.id
-        if user_id == BOT_ID:
+        if user_id == current_tenant().bot_id:
             await bot.send_message(message.chat.id, random.choice(random_mess))
             return
         await bot.restrict_chat_member(message.chat.id, message.reply_to_message.from_user.id,
@@ -379,15 +594,83 @@ async def unmute(message: types.Message):
                                        can_send_media_messages=True,
                                        can_send_other_messages=True,
                                        can_add_web_page_previews=True)
+        audit.log('unmute', message.chat.id, message.from_user.id, user_id)
+        await restrictions.lift(message.chat.id, [user_id], (MUTE,))
         await bot.send_message(message.chat.id, f'[{name}](tg://user?id={user_id}) разблокирован.')
     except (AttributeError, BadRequest):
-        sent_m = await bot.send_message(message.chat.id, text_messages['wrong_unmute_syntax'])
-        call_later(10, bot.delete_message, sent_m.chat.id, sent_m.message_id, loop=loop)
+        await send_error(message, text_messages['wrong_unmute_syntax'], 10)
+
+
+@dp.message_handler(func=lambda message: message.text.startswith('!restrictions'))
+@rate_limit(2, 'restrictions')
+@set_privileges('administrator')
+async def restrictions_list(message: types.Message):
+    """
+    Показать действующие блокировки и запреты писать в чате.
+    """
+    rows = await restrictions.active(message.chat.id)
+    if not rows:
+        await bot.send_message(message.chat.id, text_messages['restrictions_empty'])
+        return
+    lines = []
+    for row in rows:
+        until = f"до {row['until']:%Y-%m-%d %H:%M}" if row['until'] else 'навсегда'
+        lines.append(f"{row['user_id']} {row['kind']} {until} {row['reason'] or ''}".replace('`', "'"))
+    await bot.send_message(message.chat.id, 'Действующие ограничения:\n```\n' + '\n'.join(lines) + '\n```')
+
+
+@dp.message_handler(func=lambda message: message.text.startswith('!lift'))
+@rate_limit(2, 'lift')
+@set_privileges('administrator')
+async def lift(message: types.Message):
+    """
+    Снять ограничения с пользователей по id (без ответа на сообщение) или со всех сразу: !lift all.
+    """
+    split_message = message.text.split()[1:]
+    try:
+        user_ids = None if split_message == ['all'] else [int(user_id) for user_id in split_message]
+        if not split_message:
+            raise ValueError
+    except ValueError:
+        await send_error(message, text_messages['wrong_lift_syntax'], 10)
+        return
+    targets = [(row['user_id'], row['kind']) for row in await restrictions.pending(message.chat.id, user_ids)]
+    if user_ids is not None:
+        # Ограничения, выданные не через бота или до появления учета, снимаются только в Telegram
+        known = {user_id for user_id, kind in targets}
+        targets += [(user_id, kind) for user_id in dict.fromkeys(user_ids) if user_id not in known
+                    for kind in (BAN, MUTE)]
+    # Отмечаются снятыми только ограничения, которые Telegram действительно снял
+    lifted = {BAN: [], MUTE: []}
+    try:
+        for user_id, kind in targets:
+            try:
+                if kind == BAN:
+                    # Без only_if_banned Telegram удалил бы из чата пользователя, который в нем состоит
+                    await bot.request(api.Methods.UNBAN_CHAT_MEMBER,
+                                      {'chat_id': message.chat.id, 'user_id': user_id, 'only_if_banned': True})
+                else:
+                    await bot.restrict_chat_member(message.chat.id, user_id,
+                                                   can_send_messages=True,
+                                                   can_send_media_messages=True,
+                                                   can_send_other_messages=True,
+                                                   can_add_web_page_previews=True)
+            except TelegramAPIError:
+                continue
+            lifted[kind].append(user_id)
+            audit.log('lift', message.chat.id, message.from_user.id, user_id, kind)
+    finally:
+        # Уже снятые в Telegram записываются, даже если обработка прервалась
+        for kind, ids in lifted.items():
+            if ids:
+                await restrictions.lift(message.chat.id, ids, (kind,))
+    count = len({user_id for ids in lifted.values() for user_id in ids})
+    await bot.send_message(message.chat.id, text_messages['lifted'].format(count))
 
 
 @dp.message_handler(func=lambda message: message.text.startswith('!sd_ch'))
 @rate_limit(2, 'sd_ch')
-@set_privileges(MY_ID)
+@set_privileges('owner')
 async def sd_ch(message: types.Message):
     """
     Отправляет сообщение в канал.
@@ -399,11 +682,10 @@ async def sd_ch(message: types.Message):
         else:
             # Отправляемое в канал сообщение передано аргументом команде(/sd_ch text) - отправляем text.
             text = ' '.join(message.text.split()[1:])
-        await bot.send_message(MY_CHANNEL, text)
+        await bot.send_message(current_tenant().channel, text)
         await bot.send_message(message.chat.id, text_messages['success_message'], disable_web_page_preview=True)
     except (IndexError, MessageTextIsEmpty):
-        sent_m = await bot.send_message(message.chat.id, text_messages['wrong_sd_ch_syntax'])
-        call_later(10, bot.delete_message, sent_m.chat.id, sent_m.message_id, loop=loop)
+        await send_error(message, text_messages['wrong_sd_ch_syntax'], 10)
 
 
 @dp.message_handler(func=lambda message: message.text.startswith('!warn'))
@@ -413,7 +695,7 @@ async def warn(message: types.Message):
     """
     Выдать предупреждение пользователю.
     """
-    if message.reply_to_message.from_user.id == BOT_ID:
+    if message.reply_to_message.from_user.id == current_tenant().bot_id:
         await bot.send_message(message.chat.id, random.choice(random_mess))
         return
     try:
@@ -421,10 +703,9 @@ async def warn(message: types.Message):
                      'user_id': message.reply_to_message.from_user.id,
                      'name': message.reply_to_message.from_user.full_name}
     except AttributeError:
-        sent_m = await bot.send_message(message.chat.id, text_messages['wrong_warn_syntax'])
-        call_later(10, bot.delete_message, sent_m.chat.id, sent_m.message_id, loop=loop)
+        await send_error(message, text_messages['wrong_warn_syntax'], 10)
     else:
-        if (await bot.get_chat_member(message.chat.id, message.reply_to_message.from_user.id)).status in admins:
+        if await member_status(message.chat.id, message.reply_to_message.from_user.id) in admins:
             await bot.send_message(message.chat.id, text_messages['warn_admin'])
         else:
             await bot.delete_message(message.chat.id, message.reply_to_message.message_id)
@@ -439,54 +720,226 @@ async def acquit(message: types.Message):
     Снять все предупреждения с пользователю.
     """
     try:
-        if message.reply_to_message.from_user.id == BOT_ID:
+        if message.reply_to_message.from_user.id == current_tenant().bot_id:
             await bot.send_message(message.chat.id, random.choice(random_mess))
             return
         name = message.reply_to_message.from_user.full_name
         user_id = message.reply_to_message.from_user.id
         await bot.send_message(message.chat.id, f'[{name}](tg://user?id={user_id}) больше не имеет предупреждений.')
         await prepared_query['warn_delete'].fetch(message.chat.id, user_id)
+        audit.log('acquit', message.chat.id, message.from_user.id, user_id)
     except AttributeError:
-        sent_m = await bot.send_message(message.chat.id, text_messages['wrong_acquit_syntax'])
-        call_later(10, bot.delete_message, sent_m.chat.id, sent_m.message_id, loop=loop)
+        await send_error(message, text_messages['wrong_acquit_syntax'], 10)
 
 
-@dp.message_handler(func=lambda message: message.text.startswith('!settings'))
-@rate_limit(2, 'settings')
+@dp.message_handler(func=lambda message: message.text.startswith('!audit'))
+@rate_limit(2, 'audit')
 @set_privileges('administrator')
-async def settings(message: types.Message):
+async def audit_list(message: types.Message):
     """
-    Отправить настройки чата.
+    Показать журнал действий модерации в чате.
+    Ответом на сообщение - только действия с его автором. Аргумент - номер страницы.
     """
-    res = (await prepared_query['get_settings'].fetch(message.chat.id))[0]
+    try:
+        split_message = message.text.split()[1:]
+        page = int(split_message[0]) - 1 if split_message else 0
+        if page < 0:
+            raise ValueError
+    except ValueError:
+        await send_error(message, text_messages['wrong_audit_syntax'], 10)
+        return
+    user_id = message.reply_to_message.from_user.id if message.reply_to_message else None
+    rows = await audit.query(chat_id=message.chat.id, user_id=user_id, page=page, per_page=20)
+    if not rows:
+        await bot.send_message(message.chat.id, text_messages['audit_empty'])
+        return
+    lines = [f"{row['created_at']:%Y-%m-%d %H:%M} {row['action']} {row['actor_id']} -> {row['user_id']} "
+             f"{row['details'] or ''}".replace('`', "'") for row in rows]
+    await bot.send_message(message.chat.id, f'Журнал, страница {page + 1}:\n```\n' + '\n'.join(lines) + '\n```')
+
 
+@dp.message_handler(func=lambda message: message.text.startswith('!stats'))
+@rate_limit(2, 'stats')
+@set_privileges('administrator')
+async def chat_stats(message: types.Message):
+    """
+    Показать статистику активности чата за указанное количество часов (по умолчанию 24).
+    """
+    try:
+        split_message = message.text.split()[1:]
+        hours = int(split_message[0]) if split_message else 24
+        if not 1 <= hours <= 168:
+            raise ValueError
+    except ValueError:
+        await send_error(message, text_messages['wrong_stats_syntax'], 10)
+        return
+    result = await stats.query(message.chat.id, hours)
+    total = result.pop(None)
+    lines = [f'Сообщений: {total.messages} ({total.messages / hours:.1f} в час)',
+             f'Активных пользователей: ~{len(total.users)}',
+             f'Предупреждений: {total.warns}, банов: {total.bans}',
+             'Самые активные:']
+    lines += [f'  {name}: {count}' for count, name in total.posters.top(5)]
+    lines.append('По часам (UTC):')
+    lines += [f'  {hour:%d.%m %H:00} - {bucket.messages}' for hour, bucket in sorted(result.items())[-24:]]
+    text = '\n'.join(lines).replace('`', "'")
+    await bot.send_message(message.chat.id, f'Статистика за {hours} ч.:\n```\n{text}\n```')
+
+
+@dp.message_handler(func=lambda message: message.text.startswith('!load'))
+@rate_limit(2, 'load')
+@set_privileges('owner')
+async def load(message: types.Message):
+    """
+    Показать нагрузку на бота и количество отброшенной второстепенной работы.
+    """
+    shed = '\n'.join(f'{label} {what}: {count}' for (label, what), count in shedder.shed.items()) or '-'
+    bots = '\n'.join(f"{tenant.name}: {tenant.metrics['updates']} / {tenant.metrics['api_requests']}"
+                     for tenant in tenants)
+    text = text_messages['load_status'].format(shedder.in_flight, shedder.waiting, shedder.lag, shed, bots)
+    await bot.send_message(message.chat.id, f'```\n{text}\n```')
+
+
+@dp.message_handler(func=lambda message: message.text.startswith('!template_save'))
+@rate_limit(2, 'template_save')
+@set_privileges('owner')
+async def template_save(message: types.Message):
+    """
+    Сохранить настройки чата как именованный шаблон.
+    """
+    split_message = message.text.split()[1:]
+    if len(split_message) != 1 or not await save_template(pool, split_message[0], message.chat.id):
+        await send_error(message, text_messages['wrong_template_syntax'], 15)
+        return
+    await bot.send_message(message.chat.id, text_messages['template_saved'].format(italic(split_message[0])))
+
+
+@dp.message_handler(func=lambda message: message.text.startswith('!template_apply'))
+@rate_limit(2, 'template_apply')
+@set_privileges('owner')
+async def template_apply(message: types.Message):
+    """
+    Применить шаблон к этому чату, ко всем чатам (all) или к перечисленным id чатов.
+    """
+    try:
+        name, *targets = message.text.split()[1:]
+        if targets == ['all']:
+            chat_ids = None
+        else:
+            chat_ids = [int(chat_id) for chat_id in targets] or [message.chat.id]
+    except ValueError:
+        await send_error(message, text_messages['wrong_template_syntax'], 15)
+        return
+    # Другие чаты могут принадлежать другим ботам
+    if chat_ids != [message.chat.id] and message.from_user.id not in GLOBAL_ADMINS:
+        await send_error(message, text_messages['global_only'], 10)
+        return
+    changed = await apply_template(pool, name, chat_ids)
+    # Сбросить кеш настроек всех измененных чатов разом
+    reads.invalidate(None if chat_ids is None else changed)
+    await bot.send_message(message.chat.id, text_messages['template_applied'].format(italic(name), len(changed)))
+
+
+@dp.message_handler(func=lambda message: message.text.startswith('!export'))
+@rate_limit(10, 'export')
+@set_privileges('global')
+async def export(message: types.Message):
+    """
+    Выгрузить настройки всех чатов файлом csv или jsonl.
+    """
+    split_message = message.text.split()[1:]
+    fmt = split_message[0] if split_message else 'csv'
+    if fmt not in FORMATS:
+        await send_error(message, text_messages['wrong_export_syntax'], 10)
+        return
+    async with pool.acquire() as con:
+        data = await export_settings(con, fmt)
+    await bot.send_document(message.chat.id, types.InputFile(io.BytesIO(data), filename=f'settings.{fmt}'))
+
+
+@dp.message_handler(func=lambda message: message.text.startswith('!import'))
+@rate_limit(2, 'import')
+@set_privileges('global')
+async def import_request(message: types.Message):
+    """
+    Запросить файл с настройками чатов для импорта.
+    """
+    await message.reply(text_messages['get_settings_import'])
+    state = current_tenant().dp.current_state(chat=message.chat.id, user=message.from_user.id)
+    await state.set_state('WAITING_SETTINGS_IMPORT')
+
+
+@dp.message_handler(func=lambda message: message.text.startswith('!memory'))
+@rate_limit(2, 'memory')
+@set_privileges('owner')
+async def memory_status(message: types.Message):
+    """
+    Показать расход памяти кешами. !memory trace start|stop|top - управление tracemalloc.
+    """
+    split_message = message.text.split()[1:]
+    trace_action = split_message[1] if len(split_message) == 2 and split_message[0] == 'trace' else None
+    report = memory_report(trace_action)
+    lines = [f"RSS: {report['rss'] // 1024} КБ, лимит кешей: {report['budget'] // 1024} КБ"]
+    lines += [f"{cache['name']}: {cache['entries']} записей, ~{cache['bytes'] // 1024} КБ" for cache in report['caches']]
+    lines.append(f"spam_index: {report['spam_index']['entries']}/{report['spam_index']['size']}, "
+                 f"проверка сообщения ~{report['spam_index']['avg_cost_us']} мкс")
+    lines.append(f"Очередь audit: {report['audit_queue']}, задач asyncio: {report['tasks']}")
+    lines.append(f"Вытеснений: {report['evictions']}")
+    lines += report['tracemalloc']
+    text = '\n'.join(lines).replace('`', "'")
+    await bot.send_message(message.chat.id, f'```\n{text}\n```')
+
+
+def settings_keyboard(values) -> InlineKeyboardMarkup:
+    """
+    Клавиатура настроек чата по значениям values (строка таблицы settings).
+    """
     # Настройки предупреждений
     inline = InlineKeyboardMarkup(row_width=4)
     warn_count = InlineKeyboardButton("Макс. warn'ов", callback_data='max_warn')
     plus = InlineKeyboardButton('-', callback_data='-val1')
-    value1 = InlineKeyboardButton(res['max_warn'], callback_data='value1')
+    value1 = InlineKeyboardButton(values['max_warn'], callback_data='value1')
     minus = InlineKeyboardButton('+', callback_data='+val1')
     inline.add(warn_count, plus, value1, minus)
 
     # Настройки автоматических предупреждений
-    auto = 'Включены' if res['auto_warn'] else 'Выключены'
+    auto = 'Включены' if values['auto_warn'] else 'Выключены'
     auto_warn = InlineKeyboardButton("Авто warn'ы", callback_data='auto_warn')
     value2 = InlineKeyboardButton(auto, callback_data='value2')
     inline.row(auto_warn, value2)
 
-    welcome_bool = 'Включено' if res['welcome_mes'] else 'Выключено'
+    welcome_bool = 'Включено' if values['welcome_mes'] else 'Выключено'
     welcome_mes = InlineKeyboardButton("Приветствие", callback_data='welcome')
     value3 = InlineKeyboardButton(welcome_bool, callback_data='value3')
     inline.row(welcome_mes, value3)
 
+    # Пороги режима ограничений при флуде, сообщений в минуту
+    for column, title in (('slow_high', 'Флуд: вкл. от'), ('slow_low', 'Флуд: выкл. до')):
+        value = values[f'slow_rate_{column[5:]}']
+        inline.add(InlineKeyboardButton(title, callback_data=column),
+                   InlineKeyboardButton('-', callback_data=f'-{column}'),
+                   InlineKeyboardButton(value if value is not None else 'Выкл.', callback_data=f'value_{column}'),
+                   InlineKeyboardButton('+', callback_data=f'+{column}'))
+
     inline.add(InlineKeyboardButton("Запрещенные слова", callback_data='mat_list'))
 
     inline.add(InlineKeyboardButton("Сообщение при вступлении в чат", callback_data='welcome_mes'))
 
     inline.add(InlineKeyboardButton("На сколько времени ограничивать, после максимума предупреждения",
                                     callback_data='time_ban'))
+    return inline
+
 
-    await message.reply('Настройки чата:', reply_markup=inline)
+@dp.message_handler(func=lambda message: message.text.startswith('!settings'))
+@rate_limit(2, 'settings')
+@set_privileges('administrator')
+async def settings(message: types.Message):
+    """
+    Отправить настройки чата.
+    """
+    res = (await reads.fetch('get_settings', message.chat.id))[0]
+
+    await message.reply('Настройки чата:', reply_markup=settings_keyboard(res))
 
 
 @dp.callback_query_handler()
@@ -496,163 +949,64 @@ async def process_callback_settings(call: types.CallbackQuery):
     Обработка нажатий на кнопки.
     """
     if call.from_user.id == call.message.reply_to_message.from_user.id:
+        # Значение изменяется на основе прочитанного, поэтому чтение с основной базы
         res = (await prepared_query['get_settings'].fetch(call.message.chat.id))[0]
+        # Новые значения для клавиатуры
+        values = dict(res)
         if call.data == '-val1':
             if res['max_warn']-1 < 1:
                 await bot.answer_callback_query(call.id, text='Допустимые значения от 1 до 10', show_alert=True)
                 return
 
-            # Настройки предупреждений
-            inline = InlineKeyboardMarkup(row_width=4)
-            warn_count = InlineKeyboardButton("Макс. warn'ов", callback_data='max_warn')
-            plus = InlineKeyboardButton('-', callback_data='-val1')
-            value1 = InlineKeyboardButton(res['max_warn']-1, callback_data='value1')
-            minus = InlineKeyboardButton('+', callback_data='+val1')
-            inline.add(warn_count, plus, value1, minus)
-
-            # Настройки автоматических предупреждений
-            auto = 'Включены' if res['auto_warn'] else 'Выключены'
-            auto_warn = InlineKeyboardButton("Авто warn'ы", callback_data='auto_warn')
-            value2 = InlineKeyboardButton(auto, callback_data='value2')
-            inline.row(auto_warn, value2)
-
-            welcome_bool = 'Включено' if res['welcome_mes'] else 'Выключено'
-            welcome_mes = InlineKeyboardButton("Приветствие", callback_data='welcome')
-            value3 = InlineKeyboardButton(welcome_bool, callback_data='value3')
-            inline.row(welcome_mes, value3)
-
-            inline.add(InlineKeyboardButton("Запрещенные слова", callback_data='mat_list'))
-
-            inline.add(InlineKeyboardButton("Сообщение при вступлении в чат", callback_data='welcome_mes'))
-
-            inline.add(InlineKeyboardButton("На сколько времени ограничивать, после максимума предупреждения",
-                                            callback_data='time_ban'))
-
+            values['max_warn'] = res['max_warn'] - 1
             await conn.fetch('UPDATE settings SET max_warn=max_warn-1 WHERE chat_id=$1', call.message.chat.id)
-            await bot.answer_callback_query(call.id)
-            await bot.edit_message_reply_markup(call.message.chat.id,
-                                                call.message.message_id,
-                                                call.id,
-                                                reply_markup=inline)
         elif call.data == '+val1':
             if res['max_warn']+1 > 10:
                 await bot.answer_callback_query(call.id, text='Допустимые значения от 1 до 10', show_alert=True)
                 return
 
-            # Настройки предупреждений
-            inline = InlineKeyboardMarkup(row_width=4)
-            warn_count = InlineKeyboardButton("Макс. warn'ов", callback_data='max_warn')
-            plus = InlineKeyboardButton('-', callback_data='-val1')
-            value1 = InlineKeyboardButton(res['max_warn']+1, callback_data='value1')
-            minus = InlineKeyboardButton('+', callback_data='+val1')
-            inline.add(warn_count, plus, value1, minus)
-
-            # Настройки автоматических предупреждений
-            auto = 'Включены' if res['auto_warn'] else 'Выключены'
-            auto_warn = InlineKeyboardButton("Авто warn'ы", callback_data='auto_warn')
-            value2 = InlineKeyboardButton(auto, callback_data='value2')
-            inline.row(auto_warn, value2)
-            
-            welcome_bool = 'Включено' if res['welcome_mes'] else 'Выключено'
-            welcome_mes = InlineKeyboardButton("Приветствие", callback_data='welcome')
-            value3 = InlineKeyboardButton(welcome_bool, callback_data='value3')
-            inline.row(welcome_mes, value3)
-
-            inline.add(InlineKeyboardButton("Запрещенные слова", callback_data='mat_list'))
-
-            inline.add(InlineKeyboardButton("Сообщение при вступлении в чат", callback_data='welcome_mes'))
-
-            inline.add(InlineKeyboardButton("На сколько времени ограничивать, после максимума предупреждения",
-                                            callback_data='time_ban'))
-
+            values['max_warn'] = res['max_warn'] + 1
             await conn.fetch('UPDATE settings SET max_warn=max_warn+1 WHERE chat_id=$1', call.message.chat.id)
-            await bot.answer_callback_query(call.id)
-            await bot.edit_message_reply_markup(call.message.chat.id,
-                                                call.message.message_id,
-                                                call.id,
-                                                reply_markup=inline)
         elif call.data == 'value2':
-
-            # Настройки предупреждений
-            inline = InlineKeyboardMarkup(row_width=4)
-            warn_count = InlineKeyboardButton("Макс. warn'ов", callback_data='max_warn')
-            plus = InlineKeyboardButton('-', callback_data='-val1')
-            value1 = InlineKeyboardButton(res['max_warn'], callback_data='value1')
-            minus = InlineKeyboardButton('+', callback_data='+val1')
-            inline.add(warn_count, plus, value1, minus)
-
-            # Настройки автоматических предупреждений
-            auto = 'Включены' if not res['auto_warn'] else 'Выключены'
-            auto_warn = InlineKeyboardButton("Авто warn'ы", callback_data='auto_warn')
-            value2 = InlineKeyboardButton(auto, callback_data='value2')
-            inline.row(auto_warn, value2)
-
-            welcome_bool = 'Включено' if res['welcome_mes'] else 'Выключено'
-            welcome_mes = InlineKeyboardButton("Приветствие", callback_data='welcome')
-            value3 = InlineKeyboardButton(welcome_bool, callback_data='value3')
-            inline.row(welcome_mes, value3)
-
-            inline.add(InlineKeyboardButton("Запрещенные слова", callback_data='mat_list'))
-
-            inline.add(InlineKeyboardButton("Сообщение при вступлении в чат", callback_data='welcome_mes'))
-
-            inline.add(InlineKeyboardButton("На сколько времени ограничивать, после максимума предупреждения",
-                                            callback_data='time_ban'))
-
+            values['auto_warn'] = not res['auto_warn']
             await conn.fetch('UPDATE settings SET auto_warn=NOT auto_warn WHERE chat_id=$1', call.message.chat.id)
-            await bot.answer_callback_query(call.id)
-            await bot.edit_message_reply_markup(call.message.chat.id,
-                                                call.message.message_id,
-                                                call.id,
-                                                reply_markup=inline)
         elif call.data == 'value3':
-
-            # Настройки предупреждений
-            inline = InlineKeyboardMarkup(row_width=4)
-            warn_count = InlineKeyboardButton("Макс. warn'ов", callback_data='max_warn')
-            plus = InlineKeyboardButton('-', callback_data='-val1')
-            value1 = InlineKeyboardButton(res['max_warn'], callback_data='value1')
-            minus = InlineKeyboardButton('+', callback_data='+val1')
-            inline.add(warn_count, plus, value1, minus)
-
-            # Настройки автоматических предупреждений
-            auto = 'Включены' if res['auto_warn'] else 'Выключены'
-            auto_warn = InlineKeyboardButton("Авто warn'ы", callback_data='auto_warn')
-            value2 = InlineKeyboardButton(auto, callback_data='value2')
-            inline.row(auto_warn, value2)
-
-            welcome_bool = 'Включено' if not res['welcome_mes'] else 'Выключено'
             welcome_db = 'Привет, {name}' if not res['welcome_mes'] else None
-            welcome_mes = InlineKeyboardButton("Приветствие", callback_data='welcome')
-            value3 = InlineKeyboardButton(welcome_bool, callback_data='value3')
-            inline.row(welcome_mes, value3)
-
-            inline.add(InlineKeyboardButton("Запрещенные слова", callback_data='mat_list'))
-
-            inline.add(InlineKeyboardButton("Сообщение при вступлении в чат", callback_data='welcome_mes'))
-
-            inline.add(InlineKeyboardButton("На сколько времени ограничивать, после максимума предупреждения",
-                                            callback_data='time_ban'))
-
+            values['welcome_mes'] = welcome_db
             await conn.fetch('UPDATE settings SET welcome_mes=$1 WHERE chat_id=$2', welcome_db, call.message.chat.id)
+        elif call.data in ('-slow_high', '+slow_high', '-slow_low', '+slow_low'):
+            column = f'slow_rate_{call.data[6:]}'
+            step = SLOW_RATE_STEP if call.data[0] == '+' else -SLOW_RATE_STEP
+            values[column] = (res[column] or 0) + step
+            if not 0 < (values['slow_rate_low'] or 0) < (values['slow_rate_high'] or 0):
+                await bot.answer_callback_query(call.id, text=text_messages['wrong_slow_rate'], show_alert=True)
+                return
 
-            await bot.answer_callback_query(call.id)
-            await bot.edit_message_reply_markup(call.message.chat.id,
-                                                call.message.message_id,
-                                                call.id,
-                                                reply_markup=inline)
+            await conn.fetch(f'UPDATE settings SET {column}=$1 WHERE chat_id=$2', values[column], call.message.chat.id)
         elif call.data == 'mat_list':
             await call.message.reply(text_messages['get_mat_list'])
-            state = dp.current_state(chat=call.message.chat.id, user=call.from_user.id)
+            state = current_tenant().dp.current_state(chat=call.message.chat.id, user=call.from_user.id)
             await state.set_state('WAITING_MAT_LIST')
+            return
         elif call.data == 'welcome_mes':
             await call.message.reply(text_messages['get_welcome_mes'])
-            state = dp.current_state(chat=call.message.chat.id, user=call.from_user.id)
+            state = current_tenant().dp.current_state(chat=call.message.chat.id, user=call.from_user.id)
             await state.set_state('WAITING_WELCOME_MES')
+            return
         elif call.data == 'time_ban':
             await call.message.reply(text_messages['get_time_ban'])
-            state = dp.current_state(chat=call.message.chat.id, user=call.from_user.id)
+            state = current_tenant().dp.current_state(chat=call.message.chat.id, user=call.from_user.id)
             await state.set_state('WAITING_TIME_BAN')
+            return
+        else:
+            return
+
+        reads.invalidate([call.message.chat.id])
+        await bot.answer_callback_query(call.id)
+        await bot.edit_message_reply_markup(call.message.chat.id,
+                                            call.message.message_id,
+                                            call.id,
+                                            reply_markup=settings_keyboard(values))
     else:
         await bot.answer_callback_query(call.id, text='Вы не админ или не вызывали настройки')
 
@@ -663,7 +1017,7 @@ async def cancel_handler(message: types.Message):
     """
     Отменяет состояние получения файла.
     """
-    with dp.current_state(chat=message.chat.id, user=message.from_user.id) as state:
+    with current_tenant().dp.current_state(chat=message.chat.id, user=message.from_user.id) as state:
         if await state.get_state() is None:
             return
 
@@ -676,25 +1030,52 @@ async def process_mat_list(message: types.Message):
     """
     Ожидает файл с запрещенными словами и записывает их в БД.
     """
-    with dp.current_state(chat=message.chat.id, user=message.from_user.id) as state:
+    with current_tenant().dp.current_state(chat=message.chat.id, user=message.from_user.id) as state:
         if message.document.file_size < 4554432 and message.document.file_name == 'mat-list':
             try:
                 file = await bot.download_file_by_id(message.document.file_id)
                 text = file.read().decode('utf-8').strip()
                 await conn.execute("UPDATE settings SET mat_list=$1 WHERE chat_id=$2", text, message.chat.id)
+                reads.invalidate([message.chat.id])
                 await bot.send_message(message.chat.id, f'Файл {message.document.file_name} получен и записан в БД.')
             except:
                 await bot.send_message(message.chat.id, f'Ошибка при чтении или записи файла.')
         await state.finish()
 
 
+@dp.message_handler(state='WAITING_SETTINGS_IMPORT', content_types=ContentType.DOCUMENT)
+async def process_settings_import(message: types.Message):
+    """
+    Ожидает файл settings.csv или settings.jsonl и импортирует настройки чатов.
+    """
+    with current_tenant().dp.current_state(chat=message.chat.id, user=message.from_user.id) as state:
+        try:
+            fmt = (message.document.file_name or '').rsplit('.', 1)[-1]
+            if message.document.file_size < 20 * 1024 * 1024 and fmt in FORMATS:
+                try:
+                    file = await bot.download_file_by_id(message.document.file_id)
+                    present, records = parse_settings(file.read(), fmt)
+                    async with pool.acquire() as con:
+                        changed = await import_settings(con, records, present)
+                    # Сбросить кеш настроек всех чатов разом
+                    reads.invalidate()
+                    await bot.send_message(message.chat.id,
+                                           text_messages['settings_imported'].format(len(changed)))
+                except (ValueError, KeyError, TypeError, csv.Error, UnicodeDecodeError, asyncpg.PostgresError):
+                    await bot.send_message(message.chat.id, text_messages['settings_import_error'])
+        finally:
+            # Ожидание файла завершается при любом исходе
+            await state.finish()
+
+
 @dp.message_handler(state='WAITING_WELCOME_MES', content_types=ContentType.TEXT)
 async def process_welcome_mes(message: types.Message):
     """
     Ожидает сообщение с приветствием и записывает их в БД.
     """
-    with dp.current_state(chat=message.chat.id, user=message.from_user.id) as state:
+    with current_tenant().dp.current_state(chat=message.chat.id, user=message.from_user.id) as state:
         await conn.execute("UPDATE settings SET welcome_mes=$1 WHERE chat_id=$2", message.text, message.chat.id)
+        reads.invalidate([message.chat.id])
         await bot.send_message(message.chat.id, 'Приветствие успешно записано в БД.')
         await state.finish()
 
@@ -704,9 +1085,10 @@ async def process_time_ban(message: types.Message):
     """
     Ожидает время бана и записывает их в БД.
     """
-    with dp.current_state(chat=message.chat.id, user=message.from_user.id) as state:
+    with current_tenant().dp.current_state(chat=message.chat.id, user=message.from_user.id) as state:
         try:
             await conn.execute("UPDATE settings SET time_ban=$1 WHERE chat_id=$2", int(message.text), message.chat.id)
+            reads.invalidate([message.chat.id])
             await bot.send_message(message.chat.id, 'Время блокировки успешно записано в БД.')
         except:
             await bot.send_message(message.chat.id, 'Обнаружена ошибка.')
@@ -723,36 +1105,99 @@ async def command_filter(message: types.Message):
     await bot.delete_message(message.chat.id, message.message_id)
 
 async def on_startup(app):
-    webhook = await bot.get_webhook_info()
+    app['audit_task'] = loop.create_task(audit.run())
+    app['stats_task'] = loop.create_task(stats.run())
+    app['shedder_task'] = loop.create_task(shedder.monitor())
+    app['replicas_task'] = loop.create_task(reads.monitor())
+    app['memory_task'] = loop.create_task(memory.run())
+    app['slow_mode_task'] = loop.create_task(slow_mode_monitor())
+    app['restrictions_task'] = loop.create_task(restrictions.run())
+
+    # Отложенные вызовы, сохраненные предыдущим процессом. Он может остановиться
+    # уже после нашего запуска, поэтому таблица проверяется, пока он завершается
+    await restore_jobs(conn, tenants, loop)
+    app['jobs_task'] = loop.create_task(restore_jobs_during_handoff(pool, tenants, loop, SHUTDOWN_TIMEOUT + 30))
+
+    if INGEST_MODE == 'polling':
+        app['pollers'] = [Poller(tenant, pool, POLLING_TIMEOUT, POLLING_LIMIT) for tenant in tenants]
+        for poller in app['pollers']:
+            poller.start(loop)
+        return
 
-    if webhook.url != WEBHOOK_URL:
-        if not webhook.url:
-            await bot.delete_webhook()
+    for tenant in tenants:
+        webhook_url = f"https://{WEBHOOK_HOST}:{WEBHOOK_PORT}{tenant.path}"
+        webhook = await tenant.bot.get_webhook_info()
 
-        await bot.set_webhook(WEBHOOK_URL, certificate=open(WEBHOOK_SSL_CERT, 'rb'))
+        if webhook.url != webhook_url:
+            if not webhook.url:
+                await tenant.bot.delete_webhook()
+
+            await tenant.bot.set_webhook(webhook_url, certificate=open(WEBHOOK_SSL_CERT, 'rb'))
 
 
 async def on_shutdown(app):
     """
     Выполняется при выключении бота.
+    Webhook остается зарегистрированным, чтобы обновления получил следующий процесс.
     """
-    await bot.delete_webhook()
+    for poller in app.get('pollers', []):
+        await poller.stop()
+    if not await shedder.drain(SHUTDOWN_TIMEOUT):
+        log.warning(f'Не дождались обработки {shedder.in_flight} обновлений')
+    app['jobs_task'].cancel()
+    await save_jobs(conn, tenants)
+    # Фоновые записи не отменяются посреди пачки: задачи завершаются сами, затем сбрасывается остаток
+    audit.stop()
+    stats.stop()
+    await asyncio.gather(app['audit_task'], app['stats_task'])
+    await audit.flush()
+    await stats.flush()
+    app['shedder_task'].cancel()
+    app['replicas_task'].cancel()
+    app['memory_task'].cancel()
+    app['slow_mode_task'].cancel()
+    app['restrictions_task'].cancel()
+    for replica in replicas:
+        await replica.close()
+    await pool.close()
     await conn.close()
-    await dp.storage.close()
-    await dp.storage.wait_closed()
+    for tenant in tenants:
+        await tenant.dp.storage.close()
+        await tenant.dp.storage.wait_closed()
 
 
 if __name__ == '__main__':
-    dp.middleware.setup(AntiFlood())
-    dp.middleware.setup(CallbackAntiFlood())
-    dp.middleware.setup(WordsFilter())
+    app = web.Application()
+    app[BOT_DISPATCHER_KEY] = dp
+
+    for tenant in tenants:
+        share_handlers(dp, tenant.dp)
+
+        tenant.dp.middleware.setup(StatsCounter())
+        tenant.dp.middleware.setup(SlowModeGuard())
+        tenant.dp.middleware.setup(AntiFlood())
+        tenant.dp.middleware.setup(CallbackAntiFlood())
+        tenant.dp.middleware.setup(SpamFilter())
+        tenant.dp.middleware.setup(WordsFilter())
 
-    app = get_new_configured_app(dispatcher=dp, path=WEBHOOK_URL_PATH)
+        if INGEST_MODE == 'webhook':
+            app.router.add_route('*', tenant.path, TenantWebhookHandler, name=f'webhook_{tenant.name}')
+
+    setup_routes(app, audit=audit, shedder=shedder, tenants=tenants, memory_report=memory_report)
 
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
 
-    context_ssl = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
-    context_ssl.load_cert_chain(WEBHOOK_SSL_CERT, WEBHOOK_SSL_PRIV)
+    # При long polling сервер нужен только для admin API, сертификат не требуется
+    context_ssl = None
+    if INGEST_MODE == 'webhook':
+        context_ssl = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
+        context_ssl.load_cert_chain(WEBHOOK_SSL_CERT, WEBHOOK_SSL_PRIV)
+
+    # SO_REUSEPORT позволяет новому процессу начать слушать порт до остановки старого
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((WEBAPP_HOST, WEBAPP_PORT))
 
-    web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT, ssl_context=context_ssl)
+    web.run_app(app, sock=sock, ssl_context=context_ssl, shutdown_timeout=SHUTDOWN_TIMEOUT)